@@ -1,176 +1,342 @@
+import copy
+from functools import lru_cache
+
 import numpy as np
 from quantum_state import QuantumState
 
 
+@lru_cache(maxsize=None)
+def win_masks(size, length):
+    # bitmasks of every row, column and diagonal of `length` squares on a size x size board,
+    # bit row * size + column belonging to square (row, column)
+    masks = []
+    for row in range(size):
+        for column in range(size):
+            for d_row, d_column in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                end_row = row + d_row * (length - 1)
+                end_column = column + d_column * (length - 1)
+                if 0 <= end_row < size and 0 <= end_column < size:
+                    masks.append(sum(1 << ((row + d_row * i) * size + column + d_column * i) for i in range(length)))
+    return tuple(masks)
+
+
+# state of a square
+UNKNOWN = 0
+X = 1
+O = 2
+
+SYMBOLS = {X: "X", O: "O"}
+
+
 class Board:
-    def __init__(self, size=3):
-        # initialize board
-        self.squares = np.empty((size, size), dtype=Qubit)
-        self.qs = QuantumState()
+    def __init__(self, size=3, backend="local", win_length=None, moves=20, swaps=2):
+        # initialize board, backend is passed on to the QuantumState
+        # win_length squares in a row are needed to win, by default the whole width of the board
+        # moves is the length of the game and every player may swap swaps times
+        self.size = size
+        self.win_masks = win_masks(size, win_length or size)
+
+        # every square is stored at index row * size + column of flat arrays:
+        # the probability of the qubit and whether it collapsed to X or O
+        self.probabilities = np.full(size * size, 0.5)
+        self.states = np.full(size * size, UNKNOWN, dtype=np.int8)
+
+        # entangled squares as a disjoint-set forest, every square points towards the root of its group
+        self.parent = np.arange(size * size)
+        self.group_size = np.ones(size * size, dtype=int)
+
+        # collapsed squares as bitboards, bit i belongs to qubit i
+        self.x_bits = 0
+        self.o_bits = 0
+        self.qs = QuantumState(size, backend)
+        self.verbose = True  # print what happens, bots searching on copies turn this off
+
+        # the player to move and what is left of the game
+        self.player = 1
+        self.moves_left = moves
+        self.swaps_left = [swaps, swaps]
+
+    def next_turn(self):
+        # hand the turn to the other player
+        self.player = 2 if self.player == 1 else 1
+        self.moves_left -= 1
+
+    def snapshot(self):
+        # the whole game as restore needs it, the quantum state is only copied once it changes
+        return {
+            "probabilities": self.probabilities.copy(),
+            "states": self.states.copy(),
+            "parent": self.parent.copy(),
+            "group_size": self.group_size.copy(),
+            "player": self.player,
+            "moves_left": self.moves_left,
+            "swaps_left": list(self.swaps_left),
+            "quantum_state": self.qs.snapshot()
+        }
+
+    def restore(self, snapshot):
+        # go back to a snapshot, the same snapshot can be restored more than once
+        self.probabilities = snapshot["probabilities"].copy()
+        self.states = snapshot["states"].copy()
+        self.parent = snapshot["parent"].copy()
+        self.group_size = snapshot["group_size"].copy()
+        self.player = snapshot["player"]
+        self.moves_left = snapshot["moves_left"]
+        self.swaps_left = list(snapshot["swaps_left"])
+        self.qs.restore(snapshot["quantum_state"])
+        self.__update_bits()
+
+    def copy(self):
+        # independent board in the same position, the quantum state is shared until one of them measures
+        board = copy.copy(self)
+        board.qs = copy.copy(self.qs)
+        board.restore(self.snapshot())
+        return board
+
+    def legal_actions(self):
+        # every action the player to move can take, as (name, position) or (name, position1, position2)
+        unknown = [divmod(int(i), self.size) for i in self.unknown()]
+        actions = []
+        for position in unknown:
+            probability = self.get_probability(position)
+            if (self.player == 1 and probability >= 0.25) or (self.player == 2 and probability <= 0.75):
+                actions.append(("move", position))
+        for a in range(len(unknown)):
+            for b in range(a + 1, len(unknown)):
+                if self.swaps_left[self.player - 1] > 0:
+                    actions.append(("swap", unknown[a], unknown[b]))
+                actions.append(("entangle", unknown[a], unknown[b]))
+        actions.extend(("collapse", position) for position in unknown)
+        return actions
+
+    def apply(self, action):
+        # carry out an action of the player to move, without handing over the turn
+        name, *positions = action
+        if name == "move":
+            self.move(positions[0], self.player)
+        elif name == "swap":
+            self.swap(*positions)
+            self.swaps_left[self.player - 1] -= 1
+        elif name == "entangle":
+            self.entangle(*positions)
+        elif name == "collapse":
+            self.measure(positions[0])
+        else:
+            raise ValueError(f"Unknown action {name}")
+
+    def play(self, action):
+        # apply an action and hand over the turn, collapsing the board when the last move is played
+        self.apply(action)
+        self.next_turn()
+        if self.moves_left < 1 and len(self.check_win()) != 1:
+            self.measure_all()
 
-        # create each qubit
-        j = 0
-        for i in range(size):
-            for j in range(size):
-                self.squares[i, j] = Qubit((i, j))
+    def is_over(self):
+        # the game ends when exactly one player has a line, or when there is nothing left to play
+        return len(self.check_win()) == 1 or self.moves_left < 1 or len(self.unknown()) == 0
+
+    def key(self):
+        # hashable snapshot of the classical part of the board
+        return (self.probabilities.tobytes(), self.states.tobytes(), self.labels().tobytes())
 
     def check_win(self):
-        # convert all elements to strings
-        squares = self.squares.astype(str)
+        # a player wins if all squares of a line are theirs
         wins = set()
-
-        # check all rows if all entries are either X or O
-        for i in range(squares.shape[0]):
-            row = np.unique(squares[i])
-            if row.size == 1 and (row[0] == "X" or row[0] == "O"):
-                print(row[0] + " wins!")
-                wins.add(row[0])
-
-        # check all columns if all entries are either X or O
-        for i in range(self.squares.shape[0]):
-            column = np.unique(squares[:, i])
-            if column.size == 1 and (column[0] == "X" or column[0] == "O"):
-                print(column[0] + " wins!")
-                wins.add(column[0])
-
-        # check diagonal if all entries are either X or O
-        diagonal = np.unique(np.diagonal(squares))
-        if diagonal.size == 1 and (diagonal[0] == "X" or diagonal[0] == "O"):
-            print(diagonal[0] + " wins!")
-            wins.add(diagonal[0])
-
-        # check off-diagonal if all entries are either X or O
-        # can do this in a more clever way , right now is for 3x3
-        offdiagonal = np.unique(np.array((squares[0][2], squares[1][1], squares[2][0])))
-        if offdiagonal.size == 1 and (offdiagonal[0] == "X" or offdiagonal[0] == "O"):
-            print(offdiagonal[0] + " wins!")
-            wins.add(offdiagonal[0])
+        for symbol, bits in (("X", self.x_bits), ("O", self.o_bits)):
+            if any(bits & mask == mask for mask in self.win_masks):
+                if self.verbose:
+                    print(symbol + " wins!")
+                wins.add(symbol)
 
         return wins
 
     def move(self, position: tuple, player):
         # player 1 goes toward 0, player 2 goes toward 1
         if player == 1:
-            self.squares[position[0]][position[1]].probability -= 0.25
-            self.qs.move(position[0] * 3 + position[1], player)
-            print("player 1")
+            self.probabilities[self.index(position)] -= 0.25
+            self.qs.move(self.index(position), player)
+            if self.verbose:
+                print("player 1")
 
         elif player == 2:
-            self.squares[position[0]][position[1]].probability += 0.25
-            self.qs.move(position[0] * 3 + position[1], player)
-            print("player 2")
+            self.probabilities[self.index(position)] += 0.25
+            self.qs.move(self.index(position), player)
+            if self.verbose:
+                print("player 2")
 
         else:
             raise ValueError("Not a valid player: should be 1 or 2")
 
+    def index(self, position):
+        # index of the qubit belonging to a (row, column) position
+        return position[0] * self.size + position[1]
+
     def get_qubit(self, position):
-        return self.squares[position[0], position[1]]
+        return Qubit(self, self.index(position))
 
     def get_probability(self, position):
-        return self.get_qubit(position).probability
+        return self.probabilities[self.index(position)]
+
+    def get_entangled(self, position):
+        return self.get_qubit(position).entangled
+
+    def get_symbol(self, position):
+        # "X" or "O" for collapsed squares, None while the square is still a qubit
+        return SYMBOLS.get(self.states[self.index(position)])
 
-    def get_entagled(self, position):
-        return self.get_qubit(position).entagled
+    def unknown(self):
+        # indices of the squares which have not collapsed yet
+        return np.flatnonzero(self.states == UNKNOWN)
 
     def swap(self, position1, position2):
-        q1 = self.get_qubit(position1)
-        q2 = self.get_qubit(position2)
-        self.squares[position1[0], position1[1]] = q2
-        self.squares[position1[0], position1[1]].position = position2
-        self.squares[position2[0], position2[1]] = q1
-        self.squares[position2[0], position2[1]].position = position1
-        q2.position = position1
-        q1.position = position2
-        self.qs.swap(position1[0] * 3 + position1[1], position2[0] * 3 + position2[1])
+        # the squares trade their probability, state and entanglement
+        i, j = self.index(position1), self.index(position2)
+        order = np.arange(self.size * self.size)
+        order[[i, j]] = j, i
+        self.probabilities = self.probabilities[order]
+        self.states = self.states[order]
+        # order is its own inverse, so relabelling the squares in the forest is a lookup
+        self.parent = order[self.parent[order]]
+        self.group_size = self.group_size[order]
+        self.__update_bits()
+        self.qs.swap(i, j)
 
     def entangle(self, position1, position2):
-        q1 = self.get_qubit(position1)
-        q2 = self.get_qubit(position2)
-        q1.entangled.add(q2)
-        q2.entangled.add(q1)
-
-        self.qs.entangle(position1[0] * 3 + position1[1], position2[0] * 3 + position2[1])
+        i, j = self.index(position1), self.index(position2)
+        self.__union(i, j)
+
+        self.qs.entangle(i, j)
+
+    def find(self, index):
+        # root of the group of a square, halving the path on the way up
+        parent = self.parent
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return int(index)
+
+    def __union(self, i, j):
+        # merge the groups of two squares, hanging the smaller group below the larger one
+        i, j = self.find(i), self.find(j)
+        if i == j:
+            return
+        if self.group_size[i] < self.group_size[j]:
+            i, j = j, i
+        self.parent[j] = i
+        self.group_size[i] += self.group_size[j]
+
+    def labels(self):
+        # root of the group of every square
+        labels = self.parent.copy()
+        while True:
+            grandparents = labels[labels]
+            if np.array_equal(grandparents, labels):
+                return labels
+            labels = grandparents
+
+    def is_entangled(self, index):
+        return self.group_size[self.find(index)] > 1
+
+    def component(self, index):
+        # indices of all squares connected to a square through entanglement
+        if not self.is_entangled(index):
+            return np.array([index])
+        return np.flatnonzero(self.labels() == self.find(index))
 
     def measure(self, position1=None, to_measure=None):
         if to_measure is None: to_measure=set()
-        positions = []
-        for q in to_measure: positions.append(q.position[0] * 3 + q.position[1])
+        positions = [q.index for q in to_measure]
         if position1 is not None:
-            q1 = self.get_qubit(position1)
-            to_measure.add(q1)
-            positions.append(q1.position[0] * 3 + q1.position[1])
-        queue = set()
-        queue.update(q1.entangled)
-        while len(queue) != 0:
-            qx = queue.pop()
-            if qx not in to_measure:
-                to_measure.add(qx)
-                positions.append(qx.position[0] * 3 + qx.position[1])
-                queue.update(qx.entangled)
+            positions.append(self.index(position1))
+
+        # a measurement collapses the whole group of every measured square
+        labels = self.labels()
+        groups = np.isin(labels, labels[positions])
+        positions.extend(int(i) for i in np.flatnonzero(groups) if i not in positions)
 
         # do the measurement
         result = self.qs.measure(positions)
-        print(result)
+        if self.verbose:
+            print(result)
         # convert results to board X and Os
-        for qubit in to_measure:
-            idx = qubit.position[0] * 3 + qubit.position[1]
-            if result[idx] == 1:
-                self.squares[qubit.position[0], qubit.position[1]] = "X"
-            elif result[idx] == 0:
-                self.squares[qubit.position[0], qubit.position[1]] = "O"
+        positions = np.array(positions, dtype=int)
+        outcomes = np.asarray(result)[positions]
+        self.states[positions[outcomes == 1]] = X
+        self.states[positions[outcomes == 0]] = O
+        self.parent[groups] = np.flatnonzero(groups)
+        self.group_size[groups] = 1
+        self.__update_bits()
+
+    def __update_bits(self):
+        # rebuild the bitboards from the state array
+        self.x_bits = sum(1 << int(i) for i in np.flatnonzero(self.states == X))
+        self.o_bits = sum(1 << int(i) for i in np.flatnonzero(self.states == O))
+
+    def measure_all(self):
+        # collapse every square which is still a qubit
+        if len(self.unknown()) == 0:
+            return
+        self.measure(to_measure={Qubit(self, i) for i in self.unknown()})
 
     def show_board(self):
-        board = [[], [], []]
-        for i in range(self.squares.shape[0]):
-            for j in range(self.squares.shape[1]):
-                if isinstance(self.squares[i, j], Qubit):
-                    board[i].append(str(self.squares[i, j].probability))
-                else:
-                    board[i].append(str(self.squares[i, j]))
-        print('   |   |')
+        rows = []
+        for row in range(self.size):
+            rows.append([self.get_symbol((row, column)) or str(self.get_probability((row, column)))
+                         for column in range(self.size)])
 
-        print(' ' + board[0][0] + ' | ' + board[0][1] + ' | ' + board[0][2])
+        spacer = '|'.join(['   '] * self.size)
+        for row, squares in enumerate(rows):
+            if row > 0:
+                print('-' * (4 * self.size - 1))
+            print(spacer)
+            print(' ' + ' | '.join(squares))
+            print(spacer)
 
-        print('   |   |')
 
-        print('-----------')
-
-        print('   |   |')
-
-        print(' ' + board[1][0] + ' | ' + board[1][1] + ' | ' + board[1][2])
+class Qubit:
+    # view of a single square of a board, the data itself lives in the arrays of the board
+    __slots__ = ("board", "index")
 
-        print('   |   |')
+    def __init__(self, board, index):
+        self.board = board
+        self.index = index
 
-        print('-----------')
+    @property
+    def position(self):
+        return divmod(self.index, self.board.size)
 
-        print('   |   |')
+    @property
+    def probability(self):
+        return self.board.probabilities[self.index]
 
-        print(' ' + board[2][0] + ' | ' + board[2][1] + ' | ' + board[2][2])
+    @probability.setter
+    def probability(self, probability):
+        self.board.probabilities[self.index] = probability
 
-        print('   |   |')
+    @property
+    def entangled(self):
+        # the other squares of the group of this square
+        return {Qubit(self.board, int(i)) for i in self.board.component(self.index) if i != self.index}
 
+    def __eq__(self, other):
+        return isinstance(other, Qubit) and self.board is other.board and self.index == other.index
 
-class Qubit:
-    def __init__(self, position: tuple, probability=0.5, entangled=None):
-        if entangled is None:
-            entangled = set()
-        self.position = position
-        self.probability = probability
-        self.entangled = entangled
+    def __hash__(self):
+        return hash((id(self.board), self.index))
 
-    def set_position(self, position):
-        self.position = position
+    def __repr__(self):
+        return f"Qubit{self.position}"
 
 
 ## Some function calls
 # Board = Board()
 # Board.move((0, 0), 2)
 # Board.move((2, 2), 1)
-# print(Board.squares[0, 0].position)
-# print(Board.squares[2, 2].position)
+# print(Board.get_probability((0, 0)))
+# print(Board.get_probability((2, 2)))
 # Board.swap((0, 0), (2, 2))
-# print(Board.squares[0, 0].position)
-# print(Board.squares[2, 2].position)
+# print(Board.get_probability((0, 0)))
+# print(Board.get_probability((2, 2)))
 # #Board.show_board()
 # #Board.measure((0, 0))
 # Board.show_board()
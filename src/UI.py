@@ -1,7 +1,12 @@
+import threading
+
+from kivy.clock import Clock
 from kivy.lang import Builder
 from kivymd.app import MDApp
-from Board import Board, Qubit
+from Board import Board, SYMBOLS, UNKNOWN
 from quantum_bot import _, X, O, QuantumBot
+from quantum_search_bot import QuantumSearchBot
+from states_font import group_symbol, qubit_symbol
 
 
 from kivy.core.text import LabelBase
@@ -18,176 +23,226 @@ class TicTacToe(MDApp):
 
 
     # global values
-    player = 1
     action = "normal"
     first_qubit = None
     board = Board()
-    moves = 20
-    swap_left = [2,2]
+    history = []  # snapshots of the board before every move, for undo
 
     bot = QuantumBot()
+    quantum_bot = QuantumSearchBot()
+    quantum_computer = False  # the quantum computer plays O in the quantum game
     cboard = [_, _, _, _, _, _, _, _, _]
     computer = False
     turn = 1
+
+    # a quantum job is running on a worker thread, restarting increases the generation to cancel it
+    busy = False
+    generation = 0
     
 
 
     def excecute(self, btn, col, row):
+        # ignore clicks while a collapse is being computed or once the game is over
+        if self.busy or self.board.is_over():
+            return
+
         # perform action based on global value
         if self.action == "normal":
-            probability = self.board.get_qubit((row, col)).probability
+            probability = self.board.get_probability((row, col))
+            player = self.board.player
 
-            if (self.player == 1 and probability >= 0.25) or (self.player == 2 and probability <= 0.75):
-                self.board.move((row, col), self.player)
-                self.first_qubit = None
-                self.nextMove()
+            if (player == 1 and probability >= 0.25) or (player == 2 and probability <= 0.75):
+                self.play(("move", (row, col)))
 
         elif self.action == "swap":
-            if self.first_qubit is not None and self.swap_left[self.player-1] > 0:
-                self.board.swap(self.first_qubit, (row, col))
-                self.first_qubit = None
-                self.swap_left[self.player-1] -= 1
-                self.nextMove()
+            if self.first_qubit is not None and self.board.swaps_left[self.board.player-1] > 0:
+                self.play(("swap", self.first_qubit, (row, col)))
             else:
                 self.first_qubit = (row, col)
 
         elif self.action == "collapse":
-            self.first_qubit = None
-            self.board.measure((row, col))
-            self.nextMove()
+            self.play(("collapse", (row, col)))
 
         elif self.action == "entangle":
             if self.first_qubit is not None:
-                self.board.entangle(self.first_qubit, (row, col))
-                self.first_qubit = None
-                self.nextMove()
+                self.play(("entangle", self.first_qubit, (row, col)))
             else:
                 self.first_qubit = (row, col)
 
 
 
-    def nextMove(self):
-        # change the current player
-        if self.player == 1:
-            self.root.ids.score.text = "O's turn"
-            self.player = 2
+    def play(self, action):
+        # carry out an action of the player to move, collapses are computed on a worker thread
+        board = self.board
+        self.history.append(board.snapshot())
+        self.first_qubit = None
+
+        if action[0] == "collapse":
+            self.root.ids.score.text = "Collapsing..."
+            self.run_async(lambda: board.apply(action), lambda result: self.nextMove(), lambda error: self.move_failed())
         else:
-            self.root.ids.score.text = "X's turn"
-            self.player = 1
+            board.apply(action)
+            self.nextMove()
+
 
-        self.root.ids.swap.text = "Swap (" + str(self.swap_left[self.player-1]) + ")"
-        self.moves -= 1
-        self.root.ids.moves.text = str(self.moves) + " moves left"
+
+    def nextMove(self):
+        # change the current player
+        self.board.next_turn()
+        self.show_turn()
 
         # check win
-        if len(self.board.check_win()) == 1:
-            self.root.ids.score.text = self.board.check_win().pop() + " wins!"
+        win = self.board.check_win()
+        if len(win) == 1:
+            self.root.ids.score.text = win.pop() + " wins!"
             for button in self.root.ids.grid.children:
                 button.disabled = True
-        elif self.moves < 1:
+        elif self.board.moves_left < 1:
             # collapse if there are no moves left
-            qubits = set()
-            first = None
-            for i in range(3): 
-                for j in range(3):
-                    if not isinstance(self.board.squares[i, j], str):
-                        if first is None: first = (i, j)
-                        qubits.add(self.board.squares[i, j])
-            self.board.measure(first, qubits)
-            
-
-
-            win = self.board.check_win()
-            if ("O" in win and "X" in win) or len(win) is 0:
-                self.root.ids.score.text = "It's a tie"
-            else:
-                self.root.ids.score.text = win.pop() + " wins!"
-        
+            board = self.board
+            self.root.ids.score.text = "Collapsing..."
+            self.run_async(board.measure_all, lambda result: self.finish_game(), lambda error: self.move_failed())
+
+        # the grid is drawn by finish_game once the final collapse is done
+        if not self.busy:
+            self.update_grid()
+        self.first_qubit = None
+
+        if self.quantum_computer and self.board.player == 2 and not self.busy and not self.board.is_over():
+            self.quantum_ai_move()
+
+
+
+    def quantum_ai_move(self):
+        # let the search bot pick an action on a worker thread, it only reads the board
+        board = self.board
+        self.root.ids.score.text = "Quantum computer is thinking..."
+        self.run_async(lambda: self.quantum_bot.find_next_move(board), self.play, lambda error: self.show_turn())
+
+
+
+    def move_failed(self):
+        # go back to the board before the action whose collapse failed, so it can be played again
+        self.board.restore(self.history.pop())
+        self.update_grid()
+        self.show_turn()
+
 
+
+    def show_turn(self):
+        # show whose turn it is and what is left of the game
+        self.root.ids.score.text = ("X" if self.board.player == 1 else "O") + "'s turn"
+        self.root.ids.swap.text = "Swap (" + str(self.board.swaps_left[self.board.player-1]) + ")"
+        self.root.ids.moves.text = str(self.board.moves_left) + " moves left"
+
+
+
+    def undo(self):
+        # go back to the board before the last move, without simulating the game again
+        if self.busy or not self.history:
+            return
+
+        self.board.restore(self.history.pop())
+        if self.quantum_computer and self.board.player == 2 and self.history:
+            # also take back the move of the player before the computer's
+            self.board.restore(self.history.pop())
+        self.first_qubit = None
+        self.show_turn()
+        self.update_grid()
+
+
+
+    def finish_game(self):
+        # show the result once the whole board has collapsed
+        win = self.board.check_win()
+        if ("O" in win and "X" in win) or len(win) == 0:
+            self.root.ids.score.text = "It's a tie"
+        else:
+            self.root.ids.score.text = win.pop() + " wins!"
+
+        self.update_grid()
+
+
+
+    def update_grid(self):
         # array for usable colors
         colors = [[1, 0, 0, 1], [0, 1, 0, 1], [0, 0, 1, 1], [1, 1, 0, 1], [1, 0, 1, 1], [0, 1, 1, 1]]
         colors_index = 0
-        qubit_colors = {}
+        group_colors = {}
 
 
-        # go over all the buttons with corresponding qubits
-        for button, qubit in zip(self.root.ids.grid.children[::-1], self.board.squares.flatten()):
-            if isinstance(qubit, str):
+        # go over all the buttons with corresponding squares, entangled groups share a color
+        labels = self.board.labels()
+        over = self.board.is_over()
+        for index, button in enumerate(self.root.ids.grid.children[::-1]):
+            probability = self.board.probabilities[index]
+            if self.board.states[index] != UNKNOWN:
                 button.font_name = "Roboto"
-                button.text = qubit
+                button.text = SYMBOLS[self.board.states[index]]
                 button.disabled = True
                 button.text_color = [1, 1, 1, 1]
 
             else:
                 # use the states fond and select the right symbol
                 button.font_name = "States"
-                if not qubit.entangled:
-                    if qubit.probability == 1:
-                        button.text = "A"
-                    elif qubit.probability == 0:
-                        button.text = "B"
-                    elif qubit.probability == 0.5:
-                        button.text = "C"
-                    elif qubit.probability == 0.75:
-                        button.text = "D"
-                    elif qubit.probability == 0.25:
-                        button.text = "E"
+                button.disabled = over
+                if not self.board.is_entangled(index):
+                    button.text = qubit_symbol(probability) or button.text
                     button.text_color = [1, 1, 1, 1]
 
                 else:
-                    # get all the entangled qubits
-                    entangled = self.search_entangled(qubit)
-
-
                     # setup the colors
-                    if str(qubit) in qubit_colors:
-                        button.text_color = qubit_colors[str(qubit)]
-                    else:
-                        new_color = colors[colors_index]
+                    if labels[index] not in group_colors:
+                        group_colors[labels[index]] = colors[colors_index]
                         colors_index += 1
-                        button.text_color = new_color
-                        qubit_colors[str(qubit)] = new_color
-
-                        for q in entangled:
-                            qubit_colors[str(q)] = new_color
-
+                    button.text_color = group_colors[labels[index]]
 
-                    # get all the probabilities and set the state symbol
-                    probabilities = set()
-                    for q in entangled: probabilities.add(q.probability)
+                    # get all the probabilities of the group and set the state symbol
+                    probabilities = set(self.board.probabilities[labels == labels[index]].tolist())
                     self.set_text(button, probabilities)
-        
-        
-        self.first_qubit = None
 
 
 
     def cexcecute(self, btn, row, col):
-        if not self.check_win(self.cboard):
-            # player move
-            btn.text = "O"
-            btn.disabled = True
-            self.cboard[row + col *3] = O
-
-            if not self.check_win(self.cboard): 
-                # quantum computer move
-                self.ai_move()
-
-                if self.check_win(self.cboard):
-                    self.root.ids.computer_score.text = "Computer has won"
-                elif _ not in self.cboard:
-                    self.root.ids.computer_score.text = "Tie"
-            else:
-                self.root.ids.computer_score.text = "Player has won"
+        if self.busy or self.check_win(self.cboard):
+            return
 
-        if self.check_win(self.cboard):
+        # player move
+        btn.text = "O"
+        btn.disabled = True
+        self.cboard[row + col *3] = O
+
+        if not self.check_win(self.cboard): 
+            # quantum computer move
+            self.ai_move(btn, row + col * 3)
+        else:
+            self.root.ids.computer_score.text = "Player has won"
             for button in self.root.ids.computer_grid.children:
                 button.disabled = True
     
 
 
-    def ai_move(self):
-        move = self.bot.find_next_move(self.cboard, self.turn)
+    def ai_move(self, btn=None, square=None):
+        # let the bot think on a worker thread, place_ai_move is called when it is done
+        board = list(self.cboard)
+        turn = self.turn
+        self.root.ids.computer_score.text = "Quantum computer is thinking..."
+        self.run_async(lambda: self.bot.find_next_move(board, turn), self.place_ai_move,
+                       lambda error: self.ai_move_failed(btn, square))
+
+
+
+    def ai_move_failed(self, btn, square):
+        # take the move of the player back, so it can be played again once the bot is reachable
+        if btn is not None:
+            btn.text = "_"
+            btn.disabled = False
+            self.cboard[square] = _
+        self.root.ids.computer_score.text = "Quantum computer failed, try again"
+
+
+
+    def place_ai_move(self, move):
         self.root.ids.computer_grid.children[::-1][move].text = "X"
         self.root.ids.computer_grid.children[::-1][move].disabled = True
         self.cboard[move] = X
@@ -195,8 +250,55 @@ class TicTacToe(MDApp):
         print("computer move: ", move)
         self.turn += 1
 
+        if self.check_win(self.cboard):
+            self.root.ids.computer_score.text = "Computer has won"
+            for button in self.root.ids.computer_grid.children:
+                button.disabled = True
+        elif _ not in self.cboard:
+            self.root.ids.computer_score.text = "Tie"
+        else:
+            self.root.ids.computer_score.text = "Player vs Quantum computer"
+
+
+
+    def run_async(self, work, callback, on_error):
+        # run work on a worker thread so the window keeps drawing, its result is passed
+        # to callback on the Kivy clock unless the game was restarted in the meantime,
+        # and if work raises the error is passed to on_error instead
+        generation = self.generation
+        self.set_busy(True)
+
+        def worker():
+            try:
+                result = work()
+            except Exception as exc:
+                print(exc)
+                err = exc  # the name bound by except is deleted when the block ends
+                Clock.schedule_once(lambda dt, err=err: self.finish_async(generation, on_error, err))
+                return
+            Clock.schedule_once(lambda dt: self.finish_async(generation, callback, result))
+
+        threading.Thread(target=worker, daemon=True).start()
+
+
+
+    def finish_async(self, generation, callback, result):
+        if generation != self.generation:
+            return
+
+        self.set_busy(False)
+        callback(result)
+
+
+
+    def set_busy(self, busy):
+        # dim the grids while a quantum job is pending
+        self.busy = busy
+        self.root.ids.grid.opacity = .5 if busy else 1
+        self.root.ids.computer_grid.opacity = .5 if busy else 1
+
+
 
-        
     def check_win(self, board):
         for row in range(3):
             if board[3*row] is board[3*row+1] and board[3*row+1] is board[3*row+2] and board[3*row] is not _: return True
@@ -212,24 +314,11 @@ class TicTacToe(MDApp):
         
 
 
-    def search_entangled(self, qubit):
-        # DFS for getting all the entangled qubits
-        queue = set({qubit})
-        result = set({qubit})
-
-        while len(queue) != 0:
-            q = queue.pop()
-            for qubit in q.entangled:
-                if qubit not in result:
-                    result.add(qubit)
-                    queue.add(qubit)
-
-        return result
-
-
-
     def restart(self):
-        # reset all the game elements and go back to main menu
+        # cancel pending quantum jobs, reset all the game elements and go back to main menu
+        self.generation += 1
+        self.set_busy(False)
+
         for button in self.root.ids.grid.children:
             button.disabled = False
             button.font_name = "States"
@@ -240,101 +329,24 @@ class TicTacToe(MDApp):
             button.disabled = False
             button.text = "_"
 
-        self.root.ids.score.text = "X's turn"
-        self.root.ids.moves.text = "20 moves left"
+        # the first snapshot is the start of the game, so the quantum state does not have to be set up again;
+        # a collapse that is still running keeps working on the old board
+        if self.history:
+            self.board = self.board.copy()
+            self.board.restore(self.history[0])
+        self.history = []
+
+        self.show_turn()
         self.root.ids.computer_score.text = "Player vs Quantum computer"
-        self.root.ids.swap.text = "Swap (2)"
         self.cboard = [_, _, _, _, _, _, _, _, _]
         self.turn = 1
-        self.player = 1
-        self.moves = 20
-        self.swap_left = [2,2]
-        self.board = Board()
         self.root.ids.manager.current = "menu"
 
 
 
     def set_text(self, button, probabilities):
         # switch for displaying the right symbol
-        if len(probabilities) == 5:
-            button.text = "f"
-
-        elif 1 in probabilities:
-            if 0.75 in probabilities:
-                if 0.5 in probabilities:
-                    if 0.25 in probabilities:
-                        button.text = "e"
-                    else:
-                        button.text = "b"
-                elif 0.25 in probabilities:
-                    if 0 in probabilities:
-                        button.text = "a"
-                    else:
-                        button.text = "W"
-                elif 0 in probabilities:
-                    button.text = "R"
-                else:
-                    button.text = "M"
-            elif 0.5 in probabilities:
-                if 0.25 in probabilities:
-                    if 0 in probabilities:
-                        button.text = "c"
-                    else:
-                        button.text = "Y"
-                elif 0 in probabilities:
-                    button.text = "Q"
-                else:
-                    button.text = "K"
-                
-            elif 0.25 in probabilities:
-                if 0 in probabilities:
-                    button.text = "S"
-                else:
-                    button.text = "I"
-            elif 0 in probabilities:
-                button.text = "F"
-            else:
-                button.text = "A"
-        
-        elif 0.75 in probabilities:
-            if 0.5 in probabilities:
-                if 0.25 in probabilities:
-                    if 0 in probabilities:
-                        button.text = "d"
-                    else:
-                        button.text = "X"
-                elif 0 in probabilities:
-                    button.text = "Z"
-                else:
-                    button.text = "O"
-            elif 0.25 in probabilities:
-                if 0 in probabilities:
-                    button.text = "V"
-                else:
-                    button.text = "G"
-            elif 0 in probabilities:
-                button.text = "J"
-            else:
-                button.text = "D"
-        
-        elif 0.5 in probabilities:
-            if 0.25 in probabilities:
-                if 0 in probabilities:
-                    button.text = "T"
-                else:
-                    button.text = "P"
-            elif 0 in probabilities:
-                button.text = "L"
-            else:
-                button.text = "H"
-
-        elif 0.25 in probabilities:
-            if 0 in probabilities:
-                button.text = "N"
-            else:
-                button.text = "E"
-        else:
-            button.text = "B"
+        button.text = group_symbol(probabilities)
 
 
 
@@ -351,6 +363,9 @@ class TicTacToe(MDApp):
     def checkbox_click(self, instance, value):
         self.computer = value
 
+    def quantum_checkbox_click(self, instance, value):
+        self.quantum_computer = value
+
     def pulse(self):
         self.action = "normal"
         self.reset_actions()
@@ -381,5 +396,6 @@ class TicTacToe(MDApp):
 
 
 # Start app
-LabelBase.register(name='States', fn_regular='./UI/QuantumStates.ttf')
-TicTacToe().run()
+if __name__ == "__main__":
+    LabelBase.register(name='States', fn_regular='./UI/QuantumStates.ttf')
+    TicTacToe().run()
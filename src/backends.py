@@ -0,0 +1,223 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from cache import is_cacheable
+from circuit import qubit_count_of, to_qasm
+from mps import MPSState
+from simulator import BatchStatevectorSimulator, FactoredState, StatevectorSimulator
+
+
+def histogram_marginals(histogram, qubit_count):
+    """ Convert a Quantum Inspire histogram into the probability of every qubit to be in the |1> state.
+
+    Args:
+        histogram (dict): Maps the basis state index (as a string) to its probability
+        qubit_count (int): The number of qubits in the circuit
+    """
+    states = np.array([int(key) for key in histogram], dtype=np.int64)
+    weights = np.array(list(histogram.values()), dtype=float)
+    bits = (states[:, None] >> np.arange(qubit_count)) & 1
+
+    marginals = weights @ bits / weights.sum()
+    marginals[bits.all(axis=0)] = 1  # Avoid rounding errors for qubits which have collapsed
+    marginals[~bits.any(axis=0)] = 0
+    return marginals
+
+
+def collapse_histogram(histogram, qubits, rng):
+    """ Sample the measurement of qubits from a histogram and keep only the states consistent with it.
+
+    Args:
+        histogram (dict): Maps the basis state index (as a string) to its probability
+        qubits (int[]): The qubits to measure, in order
+        rng (np.random.Generator): Random number generator for the outcomes
+    """
+    states = np.array([int(key) for key in histogram], dtype=np.int64)
+    weights = np.array(list(histogram.values()), dtype=float)
+    for q in qubits:
+        ones = (states >> q) & 1 == 1
+        outcome = rng.random() < weights[ones].sum() / weights.sum()
+        states, weights = states[ones == outcome], weights[ones == outcome]
+    return {str(state): float(weight) for state, weight in zip(states, weights)}
+
+
+class LocalBackend:
+    "Executes cQASM in-process on a NumPy statevector"
+
+    def __init__(self, seed=None, engine="factored", max_bond=None):
+        """ Create a new local backend.
+
+        Args:
+            seed (int): Seed for the random number generator used by measurements and shots
+            engine (str): The engine holding the game state, "factored" statevectors or "mps", or
+                          "replay" to replay the whole game on a statevector on every measurement
+                          as is done for the remote backend
+            max_bond (int): The maximum bond dimension of the "mps" engine, None for exact simulation
+        """
+        if engine not in ("factored", "mps", "replay"):
+            raise ValueError(f"Unknown engine {engine}")
+
+        self.rng = np.random.default_rng(seed)
+        self.engine = engine
+        self.max_bond = max_bond
+        self.calls = Counter()  # number of calls per method
+
+    def create_state(self, qubit_count, initial_states):
+        """ Create a persistent state to which moves can be applied as they happen.
+
+        Args:
+            qubit_count (int): The number of qubits
+            initial_states (float[]): The probability of every qubit to be in the |1> state,
+                                      prepared with the same Ry rotations as the cQASM setup
+        """
+        self.calls["create_state"] += 1
+        if self.engine == "replay":
+            return None
+        if self.engine == "mps":
+            state = MPSState(qubit_count, self.rng, self.max_bond)
+        else:
+            state = FactoredState(qubit_count, self.rng)
+        for q, probability in enumerate(initial_states):
+            state.gate("ry", [q], np.pi * probability)
+        return state
+
+    def execute(self, qasm, number_of_shots=512, full_state_projection=True):
+        """ Execute a cQASM program and return a result in the same format as Quantum Inspire.
+
+        With full_state_projection the program is simulated once, measurements collapse the
+        state and the histogram holds the exact probabilities of the final state. Otherwise
+        measurements are deferred to the end and number_of_shots outcomes of the measured
+        qubits are sampled.
+        """
+        self.calls["execute"] += 1
+        try:
+            simulator = StatevectorSimulator(qubit_count_of(qasm), self.rng)
+            simulator.run_qasm(qasm, collapse=full_state_projection)
+        except ValueError as error:
+            return {"histogram": {}, "raw_text": str(error)}
+
+        return self.__result(simulator.probabilities(), simulator.measured, number_of_shots, full_state_projection)
+
+    def execute_batch(self, programs, number_of_shots=512, full_state_projection=True):
+        """ Execute several cQASM programs side by side and return their results in order.
+
+        The programs run in lockstep on one batch of statevectors, see execute for the results.
+        Programs which need collapsing measurements, or which fail, are executed one by one.
+        """
+        self.calls["execute_batch"] += 1
+        if full_state_projection and not all(is_cacheable(qasm, full_state_projection) for qasm in programs):
+            return [self.execute(qasm, number_of_shots, full_state_projection) for qasm in programs]
+
+        try:
+            simulator = BatchStatevectorSimulator(len(programs), max(qubit_count_of(qasm) for qasm in programs), self.rng)
+            simulator.run_qasm(programs)
+        except ValueError:
+            return [self.execute(qasm, number_of_shots, full_state_projection) for qasm in programs]
+
+        return [self.__result(probabilities, measured, number_of_shots, full_state_projection)
+                for probabilities, measured in zip(simulator.probabilities(), simulator.measured)]
+
+    def __result(self, probabilities, measured, number_of_shots, full_state_projection):
+        """Return the histogram of a final state in the format of Quantum Inspire"""
+        if full_state_projection:
+            states = np.flatnonzero(probabilities > 1e-12)
+            counts = probabilities[states]
+        else:
+            shots = self.rng.choice(probabilities.size, size=number_of_shots, p=probabilities / probabilities.sum())
+            if measured:
+                shots &= sum(1 << q for q in set(measured))
+            states, counts = np.unique(shots, return_counts=True)
+
+        counts = counts / counts.sum()
+        histogram = {str(state): float(count) for state, count in zip(states, counts)}
+        return {"histogram": histogram, "raw_text": ""}
+
+    def marginals(self, gates, qubit_count):
+        """ Execute a circuit once and return the exact probability of every qubit to be in the |1> state.
+
+        Measurements collapse the state, the random number generator is only used for those.
+
+        Args:
+            gates (Gate[]): The circuit
+            qubit_count (int): The number of qubits in the circuit
+        """
+        self.calls["marginals"] += 1
+        try:
+            simulator = StatevectorSimulator(qubit_count, self.rng)
+            simulator.run(gates)
+        except ValueError as error:
+            return {"marginals": None, "raw_text": str(error)}
+
+        return {"marginals": simulator.marginals(), "raw_text": ""}
+
+
+class RemoteBackend:
+    "Executes cQASM on a Quantum Inspire backend"
+
+    def __init__(self, api, backend_type, cache=None, seed=None):
+        """ Create a new remote backend.
+
+        Args:
+            api (QuantumInspireAPI): The authenticated api, or the CoalescingClient wrapping it
+            backend_type: The backend type as returned by api.get_backend_type_by_name
+            cache (ResultCache): Cache for the results of deterministic programs, None to disable
+            seed (int): Seed for the random number generator used to sample collapses
+        """
+        self.api = api
+        self.backend_type = backend_type
+        self.cache = cache
+        self.rng = np.random.default_rng(seed)
+        self.calls = Counter()  # number of calls per method, and the number of jobs sent to Quantum Inspire
+
+    def create_state(self, qubit_count, initial_states):
+        """Remote jobs are stateless, so the whole program is replayed on every measurement"""
+        self.calls["create_state"] += 1
+        return None
+
+    def execute(self, qasm, number_of_shots=512, full_state_projection=True):
+        """Execute a cQASM program on Quantum Inspire, reusing cached results when possible"""
+        self.calls["execute"] += 1
+        key = None
+        if self.cache is not None and is_cacheable(qasm, full_state_projection):
+            key = self.cache.key(qasm, self.backend_type, number_of_shots, full_state_projection)
+            result = self.cache.get(key)
+            if result is not None:
+                return result
+
+        self.calls["jobs"] += 1
+        result = self.api.execute_qasm(qasm=qasm, backend_type=self.backend_type, number_of_shots=number_of_shots,
+                                       full_state_projection=full_state_projection)
+
+        if key is not None and len(result["raw_text"]) == 0:
+            self.cache.put(key, {"histogram": dict(result["histogram"]), "raw_text": ""})
+        return result
+
+    def execute_batch(self, programs, number_of_shots=512, full_state_projection=True):
+        """Execute several cQASM programs as concurrent Quantum Inspire jobs and return their results in order"""
+        self.calls["execute_batch"] += 1
+        if len(programs) <= 1:
+            return [self.execute(qasm, number_of_shots, full_state_projection) for qasm in programs]
+
+        with ThreadPoolExecutor(len(programs)) as executor:
+            return list(executor.map(lambda qasm: self.execute(qasm, number_of_shots, full_state_projection), programs))
+
+    def marginals(self, gates, qubit_count, number_of_shots=512):
+        """ Execute a circuit and return the probability of every qubit to be in the |1> state.
+
+        Measurements at the end of the circuit are not sent along: the final state distribution
+        is requested instead, which can be cached, and the collapse is sampled from it locally.
+        """
+        self.calls["marginals"] += 1
+        measured = []
+        while gates and gates[-1].name.startswith("measure"):
+            measured = list(gates[-1].qubits) + measured
+            gates = gates[:-1]
+
+        result = self.execute(to_qasm(gates, qubit_count), number_of_shots=number_of_shots, full_state_projection=True)
+        if len(result["raw_text"]) > 0:
+            return {"marginals": None, "raw_text": result["raw_text"]}
+
+        histogram = collapse_histogram(result["histogram"], measured, self.rng)
+        return {"marginals": histogram_marginals(histogram, qubit_count), "raw_text": ""}
@@ -0,0 +1,188 @@
+""" Microbenchmarks of the simulation, the circuit builders and the board.
+
+Every case runs offline on a seeded LocalBackend, so runs on different commits can be
+compared. The time of a case is measured over several repeats with a fresh setup each time,
+and the peak memory allocated by one run is traced separately, e.g.
+
+    python benchmark.py --output before.json
+    python benchmark.py --compare before.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+from Board import Board
+from backends import LocalBackend
+from quantum_bot import QuantumBot, generate_w_state, multicontrolled_toffoli
+from quantum_state import QuantumState, QuantumStateBatch
+from states_font import group_symbol
+
+
+class Case:
+    "A benchmark: setup builds the input untimed, run is timed and repeated number times per measurement"
+
+    def __init__(self, name, setup, run, number=1):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.number = number
+
+
+def new_board(size, engine, seed=0):
+    board = Board(size, backend=LocalBackend(seed=seed, engine=engine))
+    board.verbose = False
+    return board
+
+
+def entangled_board(size, engine):
+    """Return a board in the middle of a game, every square entangled in one chain and half of them moved"""
+    board = new_board(size, engine)
+    positions = [divmod(i, size) for i in range(size * size)]
+    for position in positions[::2]:
+        board.move(position, 2)
+    for position1, position2 in zip(positions, positions[1:]):
+        board.entangle(position1, position2)
+    return board
+
+
+def random_game(board, seed=0):
+    """Play random legal actions until the game is over"""
+    rng = np.random.default_rng(seed)
+    while not board.is_over():
+        actions = board.legal_actions()
+        board.play(actions[rng.integers(len(actions))])
+
+
+def win_bits(board, seed=0):
+    """Fill the bitboards of a board with a random, mostly undecided position"""
+    rng = np.random.default_rng(seed)
+    owner = rng.integers(3, size=board.size ** 2)
+    board.x_bits = sum(1 << i for i in np.flatnonzero(owner == 1).tolist())
+    board.o_bits = sum(1 << i for i in np.flatnonzero(owner == 2).tolist())
+    return board
+
+
+def random_moves(games, turns=10, seed=0):
+    """Return random (move qubit, player, entangled qubits) per turn and game"""
+    rng = np.random.default_rng(seed)
+    qubits = rng.integers(9, size=(turns, 3, games))
+    return [(qubits[t, 0], 1 + t % 2, qubits[t, 1], (qubits[t, 1] + 1 + qubits[t, 2] % 8) % 9) for t in range(turns)]
+
+
+def play_states(moves):
+    """Play random moves on one QuantumState per game and measure every qubit"""
+    for game in range(len(moves[0][0])):
+        state = QuantumState(backend=LocalBackend(seed=game))
+        for qubits, player_id, q1, q2 in moves:
+            state.move(int(qubits[game]), player_id)
+            state.entangle(int(q1[game]), int(q2[game]))
+        state.measure(list(range(9)))
+
+
+def play_state_batch(moves):
+    """Play random moves on one QuantumStateBatch of all games and measure every qubit"""
+    batch = QuantumStateBatch(len(moves[0][0]), seed=0)
+    for qubits, player_id, q1, q2 in moves:
+        batch.move(qubits, player_id)
+        batch.entangle(q1, q2)
+    batch.measure([list(range(9))] * batch.batch_size)
+
+
+def winning_move_qasm(bot):
+    """Build the winning move circuit of a few positions of a game"""
+    for board_state in ([1, 0, 0, 0, 2, 0, 0, 0, 0], [1, 0, 0, 0, 2, 0, 0, 0, 1], [1, 2, 0, 0, 2, 0, 0, 0, 1]):
+        bot.board_state = board_state
+        bot.winning_move_qasm()
+
+
+GROUP_PROBABILITIES = [set(p) for p in ([0.5, 0.25], [1, 0.75, 0.5], [0, 0.25, 0.5, 0.75, 1], [0.75], [0, 1])]
+
+CASES = [
+    *[Case(f"Board.check_win[size={size}]", lambda size=size: win_bits(new_board(size, "factored")),
+           lambda board: board.check_win(), number=1000) for size in (3, 5, 7)],
+    Case("UI.set_text[group_symbol]", lambda: GROUP_PROBABILITIES,
+         lambda sets: [group_symbol(probabilities) for probabilities in sets], number=1000),
+    *[Case(f"generate_w_state[n={n}]", lambda n=n: list(range(n)), generate_w_state, number=100) for n in (3, 6, 9)],
+    *[Case(f"multicontrolled_toffoli[n={n}]", lambda n=n: list(range(n)),
+           lambda inputs: multicontrolled_toffoli(inputs, len(inputs), len(inputs) + 1), number=100) for n in (3, 6, 9)],
+    Case("QuantumBot.winning_move_qasm", lambda: QuantumBot(), winning_move_qasm, number=100),
+    *[Case(f"QuantumState.measure[empty,{engine}]", lambda engine=engine: new_board(3, engine),
+           lambda board: board.measure((1, 1))) for engine in ("replay", "factored", "mps")],
+    *[Case(f"QuantumState.measure[entangled,size={size},{engine}]",
+           lambda size=size, engine=engine: entangled_board(size, engine), lambda board: board.measure((0, 0)))
+      for size in (3, 4) for engine in ("replay", "factored", "mps")],
+    *[Case(f"full game[size={size},{engine}]", lambda size=size, engine=engine: new_board(size, engine), random_game)
+      for size in (3, 4) for engine in ("factored", "mps")],
+    *[Case(f"{name}[games={games}]", lambda games=games: random_moves(games), run)
+      for games in (64, 1024) for name, run in (("QuantumState", play_states), ("QuantumStateBatch", play_state_batch))],
+]
+
+
+def measure(case, repeats):
+    """Return the timings per call and the peak memory of a case"""
+    times = []
+    for _ in range(repeats):
+        data = case.setup()
+        start = time.perf_counter()
+        for _ in range(case.number):
+            case.run(data)
+        times.append((time.perf_counter() - start) / case.number)
+
+    data = case.setup()
+    tracemalloc.start()
+    case.run(data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"name": case.name, "number": case.number, "repeats": repeats, "min": min(times),
+            "median": statistics.median(times), "mean": statistics.mean(times), "peak_bytes": peak}
+
+
+def commit():
+    """Return the current git commit, or None outside a repository"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the simulator, the circuit builders and the board")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this text")
+    parser.add_argument("--repeats", type=int, default=5, help="number of timed repeats per case")
+    parser.add_argument("--output", default=None, help="file to write the JSON results to")
+    parser.add_argument("--compare", default=None, help="JSON results of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    previous = {}
+    if args.compare is not None:
+        with open(args.compare) as file:
+            previous = {result["name"]: result for result in json.load(file)["results"]}
+
+    results = []
+    for case in CASES:
+        if args.filter not in case.name:
+            continue
+        result = measure(case, args.repeats)
+        results.append(result)
+
+        line = f"{case.name:<50} {result['median'] * 1e6:12.1f} us {result['peak_bytes'] / 1024:10.1f} KiB"
+        if case.name in previous:
+            line += f" {result['median'] / previous[case.name]['median']:6.2f}x"
+        print(line)
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump({"commit": commit(), "python": platform.python_version(), "numpy": np.__version__,
+                       "results": results}, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from circuit import parse_qasm, qubit_count_of, to_qasm
+
+
+def is_cacheable(qasm, full_state_projection):
+    """ Whether the result of a program can be reused.
+
+    With full_state_projection a program is simulated once, so a measurement in it makes the
+    histogram a single random outcome rather than the distribution of the circuit.
+    """
+    return not (full_state_projection and any(gate.name.startswith("measure") for gate in parse_qasm(qasm)))
+
+
+class ResultCache:
+    "Least recently used cache of execution results, with an optional on-disk tier"
+
+    def __init__(self, max_entries=1024, directory=None):
+        """ Create a new cache.
+
+        Args:
+            max_entries (int): The number of results kept in memory
+            directory (str): Directory to store results in across runs, None to only keep them in memory
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # Batches look up and store results from several threads
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(qasm, backend, number_of_shots, full_state_projection):
+        """ Return the hash identifying an execution.
+
+        The program is parsed and emitted again, so formatting, case and subcircuit
+        headers do not influence the key.
+        """
+        circuit = to_qasm(parse_qasm(qasm), qubit_count_of(qasm))
+        canonical = json.dumps([circuit, str(backend), number_of_shots, bool(full_state_projection)])
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Return the cached result for a key, or None"""
+        with self.lock:
+            return self.__get(key)
+
+    def __get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.directory is not None and os.path.exists(self.__path(key)):
+            with open(self.__path(key)) as file:
+                result = json.load(file)
+            self.__store(key, result)
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        return None
+
+    def put(self, key, result):
+        """Store a result in memory and, if enabled, on disk"""
+        with self.lock:
+            self.__store(key, result)
+            if self.directory is not None:
+                with open(self.__path(key), "w") as file:
+                    json.dump(result, file)
+
+    def __store(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        """Return the number of hits, misses and entries in memory"""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+
+# Cache shared by the game and the bot, set QI_CACHE_DIR to keep results across runs
+result_cache = ResultCache(directory=os.getenv("QI_CACHE_DIR"))
@@ -0,0 +1,256 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+# A single operation of a circuit: the lowercase cQASM gate name, the qubits it acts on
+# (controls first), the rotation angle for rotation gates and the matrix for "unitary" gates
+# produced by the fusion pass.
+Gate = namedtuple("Gate", ["name", "qubits", "angle", "matrix"], defaults=(None, None))
+
+SQRT_HALF = np.sqrt(0.5)
+
+GATES = {
+    "x": np.array([[0, 1], [1, 0]], dtype=complex),
+    "y": np.array([[0, -1j], [1j, 0]], dtype=complex),
+    "z": np.array([[1, 0], [0, -1]], dtype=complex),
+    "h": np.array([[SQRT_HALF, SQRT_HALF], [SQRT_HALF, -SQRT_HALF]], dtype=complex),
+    "s": np.array([[1, 0], [0, 1j]], dtype=complex),
+    "sdag": np.array([[1, 0], [0, -1j]], dtype=complex),
+    "t": np.array([[1, 0], [0, np.exp(1j * np.pi / 4)]], dtype=complex),
+    "tdag": np.array([[1, 0], [0, np.exp(-1j * np.pi / 4)]], dtype=complex),
+    "swap": np.array([[1, 0, 0, 0], [0, 0, 1, 0], [0, 1, 0, 0], [0, 0, 0, 1]], dtype=complex),
+}
+
+# Controlled gates: name -> (number of controls, target gate)
+CONTROLLED_GATES = {
+    "cnot": (1, "x"),
+    "cz": (1, "z"),
+    "toffoli": (2, "x"),
+}
+
+
+def ry(angle):
+    """Return the matrix of a rotation about the y-axis"""
+    c, s = np.cos(angle / 2), np.sin(angle / 2)
+    return np.array([[c, -s], [s, c]], dtype=complex)
+
+
+def rx(angle):
+    """Return the matrix of a rotation about the x-axis"""
+    c, s = np.cos(angle / 2), np.sin(angle / 2)
+    return np.array([[c, -1j * s], [-1j * s, c]], dtype=complex)
+
+
+def rz(angle):
+    """Return the matrix of a rotation about the z-axis"""
+    return np.array([[np.exp(-0.5j * angle), 0], [0, np.exp(0.5j * angle)]], dtype=complex)
+
+
+ROTATIONS = {
+    "rx": rx,
+    "ry": ry,
+    "rz": rz,
+}
+
+
+def controlled_matrix(matrix, control_count):
+    """ Return the unitary of a controlled gate acting on the controls followed by the targets.
+
+    Args:
+        matrix (np.ndarray): The unitary applied to the targets
+        control_count (int): The number of controls
+    """
+    size = matrix.shape[0] * 2 ** control_count
+    result = np.eye(size, dtype=complex)
+    result[size - matrix.shape[0]:, size - matrix.shape[0]:] = matrix
+    return result
+
+
+# The entangle move as (gate, roles) where role 0 is the first and role 1 the second qubit
+ENTANGLE = [
+    ("cnot", (0, 1)),
+    ("h", (0,)), ("tdag", (1,)),
+    ("t", (0,)), ("h", (1,)),
+    ("h", (0,)),
+    ("cnot", (0, 1)),
+    ("h", (0,)), ("h", (1,)),
+    ("tdag", (0,)),
+    ("h", (0,)),
+    ("cnot", (0, 1)),
+    ("sdag", (0,)), ("s", (1,)),
+]
+
+
+def entangle_gates(q1, q2):
+    """Return the gates of the entangle move on qubits q1 and q2"""
+    qubits = (q1, q2)
+    return [Gate(name, tuple(qubits[role] for role in roles)) for name, roles in ENTANGLE]
+
+
+def entangle_matrix():
+    """Return the 4x4 unitary of the entangle move, the first qubit being the most significant"""
+    identity = np.eye(2, dtype=complex)
+    result = np.eye(4, dtype=complex)
+    for name, roles in ENTANGLE:
+        if name in CONTROLLED_GATES:
+            matrix = controlled_matrix(GATES[CONTROLLED_GATES[name][1]], 1)
+        elif roles == (0,):
+            matrix = np.kron(GATES[name], identity)
+        else:
+            matrix = np.kron(identity, GATES[name])
+        result = matrix @ result
+    return result
+
+
+ENTANGLE_MATRIX = entangle_matrix()
+
+
+def gate_matrix(gate):
+    """Return the matrix of a single-qubit gate"""
+    if gate.name == "unitary":
+        return gate.matrix
+    if gate.name in ROTATIONS:
+        return ROTATIONS[gate.name](gate.angle)
+    return GATES[gate.name]
+
+
+def optimize(gates, unitaries=True):
+    """ Fuse consecutive single-qubit gates acting on the same qubit.
+
+    A run of rotations about the same axis becomes a single rotation. With unitaries,
+    any other run becomes one "unitary" gate holding the product of the matrices, which
+    only the local simulators understand; without it the run is kept as it is, so the
+    result can still be sent to Quantum Inspire.
+
+    Args:
+        gates (Gate[]): The circuit
+        unitaries (bool): Whether to fuse runs into "unitary" gates
+    """
+    result = []
+    runs = {}  # qubit -> single-qubit gates which have not been emitted yet
+
+    def flush(q):
+        run = runs.pop(q, [])
+        if len(run) <= 1:
+            result.extend(run)
+        elif all(gate.name == run[0].name for gate in run) and run[0].name in ROTATIONS:
+            result.append(Gate(run[0].name, (q,), sum(gate.angle for gate in run)))
+        elif unitaries:
+            matrix = np.eye(2, dtype=complex)
+            for gate in run:
+                matrix = gate_matrix(gate) @ matrix
+            result.append(Gate("unitary", (q,), matrix=matrix))
+        else:
+            result.extend(run)
+
+    for gate in gates:
+        single = len(gate.qubits) == 1 and not gate.name.startswith("measure")
+        if single and (gate.name in GATES or gate.name in ROTATIONS or gate.name == "unitary"):
+            runs.setdefault(gate.qubits[0], []).append(gate)
+            continue
+
+        # Measurements act as a barrier, so trailing measurements stay at the end of the circuit
+        for q in list(runs) if gate.name.startswith("measure") else gate.qubits:
+            flush(q)
+        result.append(gate)
+
+    for q in list(runs):
+        flush(q)
+    return result
+
+
+def to_qasm(gates, qubit_count):
+    """ Emit the cQASM program for a list of gates.
+
+    Args:
+        gates (Gate[]): The gates
+        qubit_count (int): The number of qubits to allocate
+    """
+    expanded = []
+    for gate in gates:
+        if gate.name == "unitary":
+            raise ValueError("Fused unitaries can not be expressed in cQASM")
+        expanded.extend(entangle_gates(*gate.qubits) if gate.name == "entangle" else [gate])
+
+    lines = ["version 1.0", f"qubits {qubit_count}", ""]
+    for name, qubits, angle, _ in expanded:
+        if name.startswith("measure"):
+            line = f"{name} q[{', '.join(str(q) for q in qubits)}]"
+        else:
+            line = f"{name} {', '.join(f'q[{q}]' for q in qubits)}"
+        if angle is not None:
+            line += f", {float(angle)!r}"
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def parse_qubits(spec):
+    """ Convert the inside of a qubit index, e.g. "1", "0:8" or "9,10", into a list of qubits."""
+    qubits = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if ":" in part:
+            start, end = part.split(":")
+            qubits.extend(range(int(start), int(end) + 1))
+        else:
+            qubits.append(int(part))
+    return qubits
+
+
+def parse_statement(statement):
+    """Parse a single cQASM gate statement into a Gate"""
+    name, _, arguments = statement.strip().partition(" ")
+    qubits = []
+    for spec in re.findall(r"q\[([^\]]*)\]", arguments):
+        qubits.extend(parse_qubits(spec))
+
+    angle = None
+    remainder = re.sub(r"q\[[^\]]*\]", "", arguments).replace(",", " ").split()
+    if remainder:
+        angle = float(remainder[0])
+    return Gate(name.lower(), tuple(qubits), angle)
+
+
+def parse_qasm(qasm):
+    """ Parse a cQASM program into a list of gates.
+
+    Subcircuits (e.g. `.grover(2)`) are unrolled according to their iteration count. Programs
+    which are run again, such as the bot's circuits for a position, are parsed only once.
+    """
+    return list(_parse_qasm(qasm))
+
+
+@lru_cache(maxsize=1024)
+def _parse_qasm(qasm):
+    gates = []
+    subcircuit, iterations = [], 1
+
+    for line in qasm.splitlines():
+        line = line.split("#")[0].strip()
+        if not line or line.startswith("version") or line.startswith("qubits"):
+            continue
+
+        if line.startswith("."):
+            gates.extend(subcircuit * iterations)
+            match = re.match(r"\.\w+(?:\((\d+)\))?", line)
+            subcircuit, iterations = [], int(match.group(1) or 1)
+            continue
+
+        for statement in line.strip("{} ").split("|"):
+            if statement.strip():
+                subcircuit.append(parse_statement(statement))
+
+    gates.extend(subcircuit * iterations)
+    return tuple(gates)
+
+
+def qubit_count_of(qasm):
+    """Return the number of qubits declared in a cQASM program"""
+    match = re.search(r"^\s*qubits\s+(\d+)", qasm, flags=re.M)
+    if match is None:
+        raise ValueError("No qubits declaration found")
+    return int(match.group(1))
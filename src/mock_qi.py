@@ -0,0 +1,70 @@
+""" Local stand-in for the Quantum Inspire api, for load tests and runs without network.
+
+Selected by setting the API_URL environment variable to a mock:// url, whose query sets the
+behaviour of the service, e.g.
+
+    API_URL="mock://?latency=0.2&jitter=0.1&error_rate=0.05&seed=1" python tournament.py --backend remote
+
+Jobs are simulated by a LocalBackend after a delay of latency plus a uniform random part of at
+most jitter seconds, and a fraction error_rate of them fail with an error in raw_text like a
+failed job of the real service.
+"""
+import threading
+import time
+from collections import Counter
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from backends import LocalBackend
+
+
+class MockQuantumInspireAPI:
+    "The part of QuantumInspireAPI used by the game, simulated locally"
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        """ Create a new mock api.
+
+        Args:
+            latency (float): Seconds every job takes at least
+            jitter (float): Maximum number of seconds added at random to the latency
+            error_rate (float): Probability of a job to fail
+            seed (int): Seed for the delays, the errors and the simulation
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = np.random.default_rng(seed)
+        self.backend = LocalBackend(seed=seed)
+        self.lock = threading.Lock()  # the random number generators are shared by concurrent jobs
+        self.calls = Counter()  # number of jobs and failed jobs
+
+    @classmethod
+    def from_url(cls, url):
+        """Create the mock api described by the query of a mock:// url"""
+        query = parse_qs(urlparse(url).query)
+        seed = query.get("seed")
+        return cls(latency=float(query.get("latency", [0])[0]), jitter=float(query.get("jitter", [0])[0]),
+                   error_rate=float(query.get("error_rate", [0])[0]), seed=int(seed[0]) if seed else None)
+
+    def get_backend_type_by_name(self, name):
+        return {"name": name, "is_hardware_backend": False, "number_of_qubits": 26}
+
+    def execute_qasm(self, qasm, backend_type=None, number_of_shots=512, full_state_projection=True):
+        """Simulate a cQASM program and return its result in the format of QuantumInspireAPI.execute_qasm"""
+        with self.lock:
+            delay = self.latency + self.jitter * self.rng.random()
+            failed = self.rng.random() < self.error_rate
+            self.calls["jobs"] += 1
+            self.calls["errors"] += failed
+
+        start = time.time()
+        time.sleep(delay)
+        if failed:
+            result = {"histogram": {}, "raw_text": "Mock Quantum Inspire: injected error"}
+        else:
+            with self.lock:
+                result = self.backend.execute(qasm, number_of_shots, full_state_projection)
+
+        result.update(execution_time_in_seconds=time.time() - start, number_of_shots=number_of_shots)
+        return result
@@ -0,0 +1,133 @@
+""" Offline generator and lookup for the precomputed moves of the QuantumBot.
+
+Every classical position in which it is the bot's (X's) turn is encoded in base 3 with
+_ = 0, X = 1 and O = 2 on square i contributing value * 3^i. The table holds the move the
+bot plays in that position, or -1 for positions which can not occur in a game.
+
+Run `python move_table.py` to regenerate move_table.npy.
+"""
+import os
+from math import log2
+
+import numpy as np
+
+from circuit import qubit_count_of
+from simulator import StatevectorSimulator
+
+_ = 0
+X = 1
+O = 2
+
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "move_table.npy")
+
+# Squares in the order the non-winning circuit tries them: center, corners, then the edges
+MOVE_ORDER = [4, 0, 2, 6, 8, 1, 3, 5, 7]
+
+_table = None
+
+
+def encode(board_state):
+    """Return the base 3 index of a board state"""
+    return sum(value * 3 ** i for i, value in enumerate(board_state))
+
+
+def has_winner(board_state, win_conditions):
+    return any(board_state[a] != _ and board_state[a] == board_state[b] == board_state[c]
+               for a, b, c in win_conditions)
+
+
+def bot_positions(win_conditions):
+    """ Return every position which can occur with X, the bot, to move.
+
+    Both the bot and the player may have opened the game.
+    """
+    positions = set()
+    stack = [[_] * 9]
+    seen = set()
+    while stack:
+        board_state = stack.pop()
+        key = encode(board_state)
+        if key in seen:
+            continue
+        seen.add(key)
+
+        if has_winner(board_state, win_conditions) or _ not in board_state:
+            continue
+
+        x_count, o_count = board_state.count(X), board_state.count(O)
+        if x_count in (o_count, o_count - 1):
+            positions.add(key)
+
+        for player in (X, O):
+            if player == X and x_count not in (o_count, o_count - 1):
+                continue
+            if player == O and o_count not in (x_count, x_count - 1):
+                continue
+            for square in range(9):
+                if board_state[square] == _:
+                    stack.append(board_state[:square] + [player] + board_state[square + 1:])
+    return positions
+
+
+def winning_probabilities(qasm):
+    """ Return the exact distribution over the measured squares of the bot's Grover circuit.
+
+    Index k holds the probability of measuring the squares whose bits are set in k.
+    """
+    simulator = StatevectorSimulator(qubit_count_of(qasm))
+    simulator.run_qasm(qasm, collapse=False)
+    mask = sum(1 << q for q in set(simulator.measured))
+    probabilities = simulator.probabilities()
+    return np.bincount(np.arange(probabilities.size) & mask, weights=probabilities)
+
+
+def evaluate_policy(bot, board_state, win_threshold=0.5):
+    """ Return the move of the bot's policy, with the quantum circuits simulated exactly.
+
+    The random edge choice of the non-winning circuit is fixed to its first free edge.
+    """
+    if board_state.count(X) + 1 >= 3:
+        flipped = [X if value == O else O if value == X else _ for value in board_state]
+        for state in (board_state, flipped):  # Check if we can win, then if we have to block
+            bot.board_state = state
+            probabilities = winning_probabilities(bot.winning_move_qasm())
+            best_move = int(np.argmax(probabilities))
+            if probabilities[best_move] > win_threshold and best_move & (best_move - 1) == 0:
+                return int(log2(best_move))
+
+    return next(square for square in MOVE_ORDER if board_state[square] == _)
+
+
+def generate():
+    """Evaluate the policy in every position and return the table"""
+    from quantum_bot import QuantumBot
+
+    bot = QuantumBot(live=True)
+    table = np.full(3 ** 9, -1, dtype=np.int8)
+    for key in sorted(bot_positions(bot.win_conditions)):
+        board_state = [key // 3 ** i % 3 for i in range(9)]
+        table[key] = evaluate_policy(bot, board_state)
+    return table
+
+
+def load():
+    """Return the precomputed table, or None if it has not been generated"""
+    global _table
+    if _table is None and os.path.exists(TABLE_PATH):
+        _table = np.load(TABLE_PATH)
+    return _table
+
+
+def lookup(board_state):
+    """Return the precomputed move for a board state, or None if it is not in the table"""
+    table = load()
+    if table is None:
+        return None
+    move = int(table[encode(board_state)])
+    return move if move >= 0 else None
+
+
+if __name__ == "__main__":
+    table = generate()
+    np.save(TABLE_PATH, table)
+    print(f"Stored {np.count_nonzero(table >= 0)} positions in {TABLE_PATH}")
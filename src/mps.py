@@ -0,0 +1,150 @@
+import numpy as np
+
+from circuit import controlled_matrix
+from simulator import Simulator
+
+
+class MPSState(Simulator):
+    "Matrix product state simulator with a bounded bond dimension"
+
+    def __init__(self, qubit_count, rng=None, max_bond=None):
+        """ Create a new state with all qubits in the |0> state.
+
+        Every qubit is a site holding a tensor of shape (left bond, 2, right bond). Two-qubit
+        gates on sites which are not neighbours first move the sites next to each other,
+        and bonds are truncated to max_bond singular values after every two-qubit gate, so
+        memory is O(n * max_bond^2) however much of the board is entangled.
+
+        Args:
+            qubit_count (int): The number of qubits
+            rng (np.random.Generator): Random number generator used for measurements
+            max_bond (int): The maximum bond dimension, None for exact simulation
+        """
+        self.qubit_count = qubit_count
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.max_bond = max_bond
+        self.tensors = []
+        for _ in range(qubit_count):
+            tensor = np.zeros((1, 2, 1), dtype=complex)
+            tensor[0, 0, 0] = 1
+            self.tensors.append(tensor)
+        self.sites = list(range(qubit_count))  # site of every qubit
+        self.measured = []
+
+    def __apply_single(self, matrix, site):
+        self.tensors[site] = np.einsum("ts,lsr->ltr", matrix, self.tensors[site])
+
+    def __apply_pair(self, matrix, site):
+        """Apply a 4x4 unitary to the neighbouring sites site and site + 1 and split them with an SVD"""
+        left, right = self.tensors[site], self.tensors[site + 1]
+        theta = np.einsum("lsm,mtr->lstr", left, right)
+        theta = np.einsum("abst,lstr->labr", matrix.reshape(2, 2, 2, 2), theta)
+
+        l, r = theta.shape[0], theta.shape[3]
+        u, s, vh = np.linalg.svd(theta.reshape(l * 2, 2 * r), full_matrices=False)
+
+        keep = max(1, int(np.sum(s > 1e-12 * s[0])))
+        if self.max_bond is not None:
+            keep = min(keep, self.max_bond)
+        norm = np.linalg.norm(s)
+        s = s[:keep] * (norm / np.linalg.norm(s[:keep]))  # Truncation must not change the norm
+
+        self.tensors[site] = u[:, :keep].reshape(l, 2, keep)
+        self.tensors[site + 1] = (s[:, None] * vh[:keep]).reshape(keep, 2, r)
+
+    def __move_next_to(self, q, other):
+        """Swap the site of qubit q along the chain until it neighbours the site of qubit other"""
+        swap = np.eye(4, dtype=complex)[[0, 2, 1, 3]]
+        while abs(self.sites[q] - self.sites[other]) > 1:
+            site = self.sites[q]
+            step = 1 if self.sites[other] > site else -1
+            neighbour = self.sites.index(site + step)
+
+            self.__apply_pair(swap, min(site, site + step))
+            self.sites[q], self.sites[neighbour] = site + step, site
+
+    def apply(self, matrix, targets, controls=()):
+        """ Apply a (controlled) unitary acting on at most two qubits.
+
+        Args:
+            matrix (np.ndarray): A 2^k x 2^k unitary, targets[0] being the most significant qubit
+            targets (int[]): The k qubits the unitary acts on
+            controls (int[]): Qubits which all need to be |1> for the unitary to be applied
+        """
+        qubits = list(controls) + list(targets)
+        if len(set(qubits)) != len(qubits):
+            raise ValueError(f"Gate qubits must be distinct, got targets {targets} and controls {controls}")
+        if len(qubits) > 2:
+            raise ValueError("The MPS engine only supports gates on one or two qubits")
+
+        if controls:
+            matrix = controlled_matrix(matrix, len(controls))
+        if len(qubits) == 1:
+            self.__apply_single(matrix, self.sites[qubits[0]])
+            return
+
+        first, second = qubits
+        self.__move_next_to(second, first)
+        if self.sites[first] > self.sites[second]:
+            # The matrix expects the first qubit on the left site
+            matrix = matrix.reshape(2, 2, 2, 2).transpose(1, 0, 3, 2).reshape(4, 4)
+        self.__apply_pair(matrix, min(self.sites[first], self.sites[second]))
+
+    def gate(self, name, qubits, angle=None):
+        """A swap only relabels the sites of the qubits, any other gate is applied as usual"""
+        if name.lower() != "swap":
+            return super().gate(name, qubits, angle)
+
+        q1, q2 = qubits
+        if q1 == q2:
+            raise ValueError(f"Gate qubits must be distinct, got {qubits}")
+        self.sites[q1], self.sites[q2] = self.sites[q2], self.sites[q1]
+
+    def __environments(self):
+        """Return the contracted left environment before and the right environment after every site"""
+        left = [np.ones((1, 1), dtype=complex)]
+        for tensor in self.tensors:
+            left.append(np.einsum("ab,asc,bsd->cd", left[-1], tensor, tensor.conj()))
+
+        right = [np.ones((1, 1), dtype=complex)]
+        for tensor in self.tensors[::-1]:
+            right.append(np.einsum("cd,asc,bsd->ab", right[-1], tensor, tensor.conj()))
+        return left, right[::-1]
+
+    def __site_marginals(self):
+        """Return the probability of every site to be in the |1> state"""
+        left, right = self.__environments()
+        norm = left[-1][0, 0].real
+        return np.array([
+            np.einsum("ab,ac,bd,cd->", left[site], tensor[:, 1, :], tensor[:, 1, :].conj(), right[site + 1]).real / norm
+            for site, tensor in enumerate(self.tensors)
+        ])
+
+    def measure(self, qubits):
+        """ Measure qubits in the z-basis, collapsing the state.
+
+        Args:
+            qubits (int[]): The qubits to measure
+
+        Returns:
+            int[]: The measurement outcome of every qubit
+        """
+        outcomes = []
+        for q in qubits:
+            site = self.sites[q]
+            p1 = self.__site_marginals()[site]
+            outcome = int(self.rng.random() < p1)
+
+            tensor = self.tensors[site].copy()
+            tensor[:, 1 - outcome, :] = 0
+            self.tensors[site] = tensor / np.sqrt(p1 if outcome else 1 - p1)
+            outcomes.append(outcome)
+            self.measured.append(q)
+        return outcomes
+
+    def marginals(self):
+        """Return the probability of every qubit to be in the |1> state, collapsed qubits give exactly 0 or 1"""
+        marginals = self.__site_marginals()[self.sites]
+        marginals[np.isclose(marginals, 1, rtol=0, atol=1e-9)] = 1
+        marginals[np.isclose(marginals, 0, rtol=0, atol=1e-9)] = 0
+        return marginals
@@ -0,0 +1,127 @@
+""" Shared, lazily created Quantum Inspire client.
+
+Importing the game or the bot does not touch the network: the credentials are looked up, the
+api is created and the backend type is requested on the first call that needs them. The game
+and the bot share this one api, and so one authenticated session.
+
+Jobs go through a CoalescingClient wrapping the api: identical circuits requested while one
+is in flight share its job, and the jobs requested within a short window are sent together
+on a bounded number of threads, so concurrent games stay within the quota of the account.
+
+Setting API_URL to a mock:// url replaces the service by the local MockQuantumInspireAPI.
+"""
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+
+QI_URL = os.getenv("API_URL", "https://api.quantum-inspire.com/")
+PROJECT_NAME = "TicTacToe"
+BACKEND_NAME = "QX single-node simulator"
+BATCH_WINDOW = float(os.getenv("QI_BATCH_WINDOW", "0.005"))  # seconds jobs are collected before they are sent
+MAX_JOBS = int(os.getenv("QI_MAX_JOBS", "8"))  # jobs running at once, within the connection pool of the api
+
+_lock = threading.Lock()
+_api = None
+_backend_types = {}
+_client = None
+
+
+class CoalescingClient:
+    "Wraps a QuantumInspireAPI, sharing jobs between identical circuits and sending jobs in batches"
+
+    def __init__(self, api, window=BATCH_WINDOW, max_jobs=MAX_JOBS):
+        """ Create a new client.
+
+        Args:
+            api (QuantumInspireAPI): The authenticated api which runs the jobs
+            window (float): Seconds the first job of a batch waits for others before the batch is sent
+            max_jobs (int): The number of jobs which run at once
+        """
+        self.api = api
+        self.window = window
+        self.executor = ThreadPoolExecutor(max_jobs)
+        self.lock = threading.Lock()
+        self.in_flight = {}  # (qasm, backend, shots, full state projection) -> Future of the result
+        self.batch = []  # (key, future, arguments) waiting for the window to close
+        self.stats = Counter()  # requests, jobs sent, requests which shared a job and batches sent
+
+    def get_backend_type_by_name(self, name):
+        return self.api.get_backend_type_by_name(name)
+
+    def execute_qasm(self, qasm, backend_type, number_of_shots=512, full_state_projection=True):
+        """ Execute a cQASM program, with the same arguments and result as QuantumInspireAPI.execute_qasm.
+
+        The request which opens a batch waits window seconds and then sends every job collected
+        in the meantime, the others wait for their result only.
+        """
+        key = (qasm, str(backend_type), number_of_shots, bool(full_state_projection))
+        with self.lock:
+            self.stats["requests"] += 1
+            future = self.in_flight.get(key)
+            leader = False
+            if future is not None:
+                self.stats["coalesced"] += 1
+            else:
+                future = self.in_flight[key] = Future()
+                self.batch.append((key, future, dict(qasm=qasm, backend_type=backend_type,
+                                                     number_of_shots=number_of_shots,
+                                                     full_state_projection=full_state_projection)))
+                leader = len(self.batch) == 1
+
+        if leader:
+            if self.window > 0:
+                time.sleep(self.window)
+            with self.lock:
+                batch, self.batch = self.batch, []
+                self.stats["batches"] += 1
+                self.stats["jobs"] += len(batch)
+            for job in batch:
+                self.executor.submit(self.__run, *job)
+
+        return future.result()
+
+    def __run(self, key, future, arguments):
+        try:
+            future.set_result(self.api.execute_qasm(**arguments))
+        except Exception as error:
+            future.set_exception(error)
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+
+def get_api():
+    """Return the shared QuantumInspireAPI, creating it on the first call"""
+    global _api
+    with _lock:
+        if _api is None and QI_URL.startswith("mock://"):
+            from mock_qi import MockQuantumInspireAPI
+
+            _api = MockQuantumInspireAPI.from_url(QI_URL)
+        elif _api is None:
+            from quantuminspire.api import QuantumInspireAPI
+            from quantuminspire.credentials import get_authentication
+
+            _api = QuantumInspireAPI(QI_URL, authentication=get_authentication(), project_name=PROJECT_NAME)
+        return _api
+
+
+def get_backend_type(name=BACKEND_NAME):
+    """Return the backend type with the given name, requesting it only once"""
+    api = get_api()
+    with _lock:
+        if name not in _backend_types:
+            _backend_types[name] = api.get_backend_type_by_name(name)
+        return _backend_types[name]
+
+
+def get_client():
+    """Return the shared CoalescingClient around the api, creating it on the first call"""
+    global _client
+    api = get_api()
+    with _lock:
+        if _client is None:
+            _client = CoalescingClient(api)
+        return _client
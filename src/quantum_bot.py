@@ -1,14 +1,14 @@
 from math import acos, sqrt
-import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import numpy as np
 
 from math import log2
 
-from quantuminspire.api import QuantumInspireAPI
-from quantuminspire.credentials import get_authentication
+import qi_client
 from quantum_state import QuantumState
-
-QI_URL = os.getenv("API_URL", "https://api.quantum-inspire.com/")
+from cache import is_cacheable, result_cache
+import move_table
 
 _ = 0
 X = 1
@@ -25,17 +25,17 @@ WINS_3x3 = [
     [2, 4, 6]
 ]
 
-project_name = "TicTacToe Bot"
-authentication = get_authentication()
-qi_api = QuantumInspireAPI(QI_URL, authentication=authentication, project_name=project_name)
-qi_backend = qi_api.get_backend_type_by_name('QX single-node simulator')
-
-
 def execute_qasm(qasm, backend_type, number_of_shots=128, full_state_projection=False):
     """ Helper function which executes the qasm and handles errors"""
 
-    # TODO: Think about making this or the UI async to prevent the window from freezing
-    result = qi_api.execute_qasm(
+    key = None
+    if is_cacheable(qasm, full_state_projection):
+        key = result_cache.key(qasm, backend_type, number_of_shots, full_state_projection)
+        result = result_cache.get(key)
+        if result is not None:
+            return result["histogram"]
+
+    result = qi_client.get_client().execute_qasm(
         qasm=qasm,
         backend_type=backend_type,
         number_of_shots=number_of_shots,
@@ -49,10 +49,22 @@ def execute_qasm(qasm, backend_type, number_of_shots=128, full_state_projection=
         qasm = "\n".join(
             [f"{str(index + 1).rjust(log10_linecount, ' ')} |  {line}" for index, line in enumerate(lines)])
         print(f"\nIn QASM Code\n\n{qasm}")
+    elif key is not None:
+        result_cache.put(key, {"histogram": dict(result["histogram"]), "raw_text": ""})
 
     return result["histogram"]
 
 
+def execute_qasm_batch(programs, backend_type, number_of_shots=128, full_state_projection=False):
+    """ Helper function which executes independent programs as concurrent jobs and returns their histograms in order"""
+    if len(programs) <= 1:
+        return [execute_qasm(qasm, backend_type, number_of_shots, full_state_projection) for qasm in programs]
+
+    with ThreadPoolExecutor(len(programs)) as executor:
+        return list(executor.map(
+            lambda qasm: execute_qasm(qasm, backend_type, number_of_shots, full_state_projection), programs))
+
+
 def reverse_lines(str):
     """ Helper function which returns the string with the lines in reversed order"""
     return "\n".join(str.splitlines()[::-1])
@@ -120,15 +132,56 @@ def generate_w_state(qubits):
     return result, result_dag
 
 
+@lru_cache(maxsize=512)
+def winning_move_template(free_mask, board_len=9):
+    """ Returns the Grover circuit searching for a winning square, split where the X cells are set
+
+    Only the free squares change the W-state preparation and the diffuser, so the circuit is
+    built once per free-cell mask and the line setting the X cells is joined in per board.
+    """
+    free = [i for i in range(board_len) if free_mask >> i & 1]
+    x_cells = "\0" # Placeholder for the line setting the X cells
+
+    qasm = ""
+    qasm += "version 1.0\n\nqubits 17\n\n"
+
+    qasm += f".init\nh q[{board_len}]\nz q[{board_len}]\n\n"
+
+    initial_state, initial_state_dag = generate_w_state(free)
+    initial_state += x_cells
+    initial_state_dag += x_cells
+
+    qasm += initial_state
+
+    qasm += f".grover(1)\n"
+    for cond in WINS_3x3: # O(8)
+        qasm += multicontrolled_toffoli(cond, board_len, board_len + 1) # O(n)
+    qasm += "\n\n"
+
+    qasm += initial_state_dag
+    qasm += f"x q[0:{board_len - 1}]\n"
+    qasm += multicontrolled_toffoli(list(range(board_len)), board_len, board_len + 1) # O(n)
+    qasm += f"x q[0:{board_len - 1}]\n"
+    qasm += initial_state
+    qasm += "\n\n"
+
+    qasm += f".measurement\nmeasure_z q[{', '.join([str(i) for i in free])}]"
+
+    return tuple(qasm.split(x_cells))
+
+
 class QuantumBot:
     "Quantum bot for classical tic tac toe"
 
-    def __init__(self):
+    def __init__(self, live=False, backend=None):
         """ Create a new QuantumBot
         
         Args:
-            size (int): The width and height of the board
+            live (bool): Always run the quantum circuits instead of using the precomputed move table
+            backend: Backend instance which runs the circuits, e.g. a LocalBackend, None for Quantum Inspire
         """
+        self.live = live
+        self.backend = backend
         self.board_state = [_ for i in range(3 ** 2)]
         self.board_len = len(self.board_state)
         self.win_conditions = WINS_3x3
@@ -145,25 +198,29 @@ class QuantumBot:
             print("Invalid board state was given")
             return
 
+        # The table holds the move for every position, assuming the turn counts the bot's moves
+        if not self.live and turn_number == board_state.count(X) + 1:
+            move = move_table.lookup(board_state)
+            if move is not None:
+                return move
+
         win_threshold = 0.5
         self.board_state = board_state
 
         if turn_number >= 3:
-            # Check if we can win
-            results = self.generate_winning_move()
-            best_move = max(zip(results.values(), results.keys()))
-            if best_move[0] > win_threshold:
-                return int(log2(int(best_move[1])))
-
-            # Check if the opponent can win, block them
-            self.board_state = [X if value == O else O if value == X else _ for value in board_state]
-            results = self.generate_winning_move()
-            best_move = max(zip(results.values(), results.keys()))
-            if best_move[0] > win_threshold:
-                return int(log2(int(best_move[1])))
+            # Check if we can win and if the opponent can win in one batch, winning goes before blocking
+            flipped = [X if value == O else O if value == X else _ for value in board_state]
+            for results in self.generate_winning_moves([board_state, flipped]):
+                if not results:
+                    continue # The job failed
+                best_move = max(zip(results.values(), results.keys()))
+                if best_move[0] > win_threshold:
+                    return int(log2(int(best_move[1])))
 
         board_mask = int("".join("0" if value == _ else "1" for value in board_state[::-1]), 2)
         results = self.generate_non_winning_move()
+        if not results:
+            return board_state.index(_) # The job failed, take the first free square
 
         best_move = int(list(results.keys())[0])
         best_move &= 2 ** 9 - 1 # We only need the lowest 9 bits
@@ -172,36 +229,37 @@ class QuantumBot:
         return int(log2(best_move))
 
 
-    def generate_winning_move(self):
-        qasm = ""
-        qasm += "version 1.0\n\nqubits 17\n\n"
+    def execute(self, programs, number_of_shots, full_state_projection):
+        """ Execute programs together on the backend of the bot and return their histograms"""
+        if self.backend is None:
+            return execute_qasm_batch(programs, qi_client.get_backend_type(), number_of_shots, full_state_projection)
 
-        qasm += f".init\nh q[{self.board_len}]\nz q[{self.board_len}]\n\n"
+        results = self.backend.execute_batch(programs, number_of_shots, full_state_projection)
+        for result in results:
+            if len(result["raw_text"]) > 0:
+                print(result["raw_text"])
+        return [result["histogram"] for result in results]
 
-        initial_state, initial_state_dag = generate_w_state([i for i, v in enumerate(self.board_state) if v == _])
-        initial_state += f"x q[{', '.join([str(i) for i, v in enumerate(self.board_state) if v == X])}]\n\n"
-        initial_state_dag += f"x q[{', '.join([str(i) for i, v in enumerate(self.board_state) if v == X])}]\n\n"
 
-        qasm += initial_state
+    def generate_winning_move(self):
+        return self.execute([self.winning_move_qasm()], number_of_shots=32, full_state_projection=False)[0]
 
-        qasm += f".grover(1)\n"
-        for cond in self.win_conditions: # O(8)
-            qasm += multicontrolled_toffoli(cond, self.board_len, self.board_len + 1) # O(n)
-        qasm += "\n\n"
 
-        qasm += initial_state_dag
-        qasm += f"x q[0:{self.board_len - 1}]\n"
-        qasm += multicontrolled_toffoli(list(range(self.board_len)), self.board_len, self.board_len + 1) # O(n)
-        qasm += f"x q[0:{self.board_len - 1}]\n"
-        qasm += initial_state
-        qasm += "\n\n"
+    def generate_winning_moves(self, board_states):
+        """ Run the winning move circuit for several board states in one batch and return their histograms """
+        programs = []
+        for board_state in board_states:
+            self.board_state = board_state
+            programs.append(self.winning_move_qasm())
 
-        qasm += f".measurement\nmeasure_z q[{', '.join([str(i) for i, v in enumerate(self.board_state) if v == _])}]"
+        return self.execute(programs, number_of_shots=32, full_state_projection=False)
 
-        result = execute_qasm(qasm=qasm, backend_type=qi_backend, number_of_shots=32,
-                                     full_state_projection=False)
 
-        return result
+    def winning_move_qasm(self):
+        """ Returns the Grover circuit which searches for a free square that wins the game for X """
+        free_mask = sum(1 << i for i, v in enumerate(self.board_state) if v == _)
+        x_cells = f"x q[{', '.join([str(i) for i, v in enumerate(self.board_state) if v == X])}]\n\n"
+        return x_cells.join(winning_move_template(free_mask, self.board_len))
 
 
     def generate_non_winning_move(self):
@@ -375,10 +433,7 @@ class QuantumBot:
         qasm += """Toffoli q[5], q[20], q[14]\n"""
         qasm += """Toffoli q[9], q[10], q[20]\n"""
 
-        result = execute_qasm(qasm=qasm, backend_type=qi_backend, number_of_shots=128,
-                                     full_state_projection=True)
-
-        return result
+        return self.execute([qasm], number_of_shots=128, full_state_projection=True)[0]
 
 
         
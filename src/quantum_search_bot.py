@@ -0,0 +1,143 @@
+""" Monte Carlo tree search bot for the quantum game.
+
+The bot plays the full ruleset of a Board (move, swap, entangle and collapse) on copies of
+the board, whose quantum state is simulated locally. Collapses are sampled as they happen,
+so the tree is searched open loop: the statistics of a position are kept in a transposition
+table keyed on the classical board, the player to move and what is left of the game, and are
+shared by every path that reaches it.
+"""
+import math
+import os
+import time
+
+import numpy as np
+
+from rollout_pool import RolloutPool, rollout, x_score
+
+
+def position_key(board):
+    """Return the transposition table key of a board"""
+    return board.key() + (board.player, board.moves_left, tuple(board.swaps_left))
+
+
+class QuantumSearchBot:
+    "Bot for the quantum game which picks actions with Monte Carlo tree search"
+
+    def __init__(self, time_budget=0.5, workers=1, exploration=1.4, seed=None, batch_size=None):
+        """ Create a new QuantumSearchBot
+
+        Args:
+            time_budget (float): Seconds of search per move
+            workers (int): The number of processes playing out positions, None for every core
+            exploration (float): The exploration constant of the UCB1 selection
+            seed (int): Seed for the random number generators of the search and the rollouts
+            batch_size (int): The number of positions selected before they are played out
+                              together on the workers, by default four per worker
+        """
+        self.time_budget = time_budget
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.exploration = exploration
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.batch_size = batch_size if batch_size is not None else 4 * self.workers
+        self.table = {}  # position key -> {"visits": int, "actions": {action: [visits, total score]}}
+        self.pool = None
+
+    def find_next_move(self, board):
+        """ Return the action the player to move on a board should take, the most visited one.
+
+        Args:
+            board (Board): The game, which is not changed
+        """
+        root = position_key(board)
+        deadline = time.time() + self.time_budget
+        while True:
+            if self.workers <= 1:
+                self.iterate(board)
+            else:
+                self.iterate_batch(board, deadline)
+            if time.time() >= deadline:
+                break
+
+        statistics = self.table.get(root, {"actions": {}})["actions"]
+        if not statistics:
+            return board.legal_actions()[0]
+        return max(statistics, key=lambda action: statistics[action][0])
+
+    def descend(self, root):
+        """ Select a path down the tree on a copy of the board, adding the position it ends in.
+
+        Visits are counted on the way down, so a path which has not been scored yet counts as
+        a loss and the next selection of a batch prefers other paths.
+
+        Returns:
+            The path as (entry, action, player) triples and the board at its end
+        """
+        board = root.copy()
+        board.verbose = False
+        path = []
+
+        while not board.is_over():
+            key = position_key(board)
+            entry = self.table.get(key)
+            if entry is None:
+                self.table[key] = {"visits": 0, "actions": {}}
+                break
+
+            action = self.select(entry, board.legal_actions())
+            statistics = entry["actions"].setdefault(action, [0, 0.0])
+            entry["visits"] += 1
+            statistics[0] += 1
+            path.append((entry, action, board.player))
+            board.play(action)
+
+        return path, board
+
+    def update(self, path, score):
+        """Add the score of X in a played out position to the path leading to it"""
+        for entry, action, player in path:
+            entry["actions"][action][1] += score if player == 1 else 1 - score
+
+    def revert(self, path):
+        """Take back the visits counted by descend on a path which was not played out"""
+        for entry, action, _ in path:
+            entry["visits"] -= 1
+            entry["actions"][action][0] -= 1
+            if entry["actions"][action][0] == 0:
+                del entry["actions"][action]  # untried again
+
+    def iterate(self, root):
+        """Select a path, play its position out in this process and update the path"""
+        path, board = self.descend(root)
+        rollout(board, self.rng)
+        self.update(path, x_score(board))
+
+    def iterate_batch(self, root, deadline):
+        """Select a batch of paths, play their positions out on the pool and update the paths"""
+        if self.pool is None:
+            self.pool = RolloutPool(self.workers, root.size, seed=self.seed)
+
+        paths, boards = zip(*(self.descend(root) for _ in range(self.batch_size)))
+        scores = self.pool.evaluate(boards, deadline=deadline)
+        for path, score in zip(paths, scores):
+            if np.isnan(score):
+                self.revert(path)
+            else:
+                self.update(path, score)
+
+    def select(self, entry, actions):
+        """Return the action with the highest UCB1 value, trying every action once first"""
+        statistics = entry["actions"]
+        untried = [action for action in actions if action not in statistics]
+        if untried:
+            return untried[self.rng.integers(len(untried))]
+
+        log_visits = math.log(entry["visits"])
+        return max(actions, key=lambda action: statistics[action][1] / statistics[action][0] +
+                   self.exploration * math.sqrt(log_visits / statistics[action][0]))
+
+    def close(self):
+        """Stop the rollout workers, if any were started"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
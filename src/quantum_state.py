@@ -1,49 +1,41 @@
-import os
-import re
-
 import numpy as np
 
-from quantuminspire.api import QuantumInspireAPI
-from quantuminspire.credentials import get_authentication
-
-QI_URL = os.getenv("API_URL", "https://api.quantum-inspire.com/")
-
-project_name = "TicTacToe"
-authentication = get_authentication()
-qi_api = QuantumInspireAPI(QI_URL, authentication=authentication, project_name=project_name)
-qi_backend = qi_api.get_backend_type_by_name('QX single-node simulator')
+import qi_client
+from backends import LocalBackend, RemoteBackend
+from cache import result_cache
+from circuit import Gate, optimize, to_qasm
+from simulator import BatchStatevectorSimulator, gate_operation
 
 
 class QuantumState:
     "Quantum state manager"
 
-    def __init__(self, size=3):
+    def __init__(self, size=3, backend="local"):
         """ Create a new QuantumState and perform the setup.
 
         Args:
             size (int): The width and height of the board
+            backend: Where the circuits are executed, either "local", "remote" or a backend instance
         """
+        if backend == "local":
+            backend = LocalBackend()
+        elif backend == "remote":
+            backend = RemoteBackend(qi_client.get_client(), qi_client.get_backend_type(), cache=result_cache)
+
+        self.backend = backend
         self.size = size
         self.qubit_count = self.size ** 2
         self.command_queue = []
         self.initial_states = [0.5 for _ in range(self.qubit_count)]  # probabilities to be in the |1> state
-        self.qasm = ""
 
-    def __initialise_qubits(self):
-        """Return the qasm code to allocate and initialise the qubits"""
-        return f"""qubits {self.qubit_count}
-        {{ {' | '.join([f"Ry q[{i}], {np.pi * self.initial_states[i]}" for i in range(self.qubit_count)])} }}
-        """
+        # Backends that can hold a state apply the moves since the last measurement, others replay the command queue
+        self.state = self.backend.create_state(self.qubit_count, self.initial_states)
+        self.pending = []
+        self.shared = False  # whether a snapshot refers to the state, which then has to be copied before it changes
 
     def __setup(self):
-        """Return the qasm setup code."""
-        return f"""version 1.0
-        {self.__initialise_qubits()}
-        """
-
-    def reset(self):
-        """Clear the accumulated qasm code."""
-        self.qasm = ""
+        """Return the gates which initialise the qubits"""
+        return [Gate("ry", (i,), np.pi * self.initial_states[i]) for i in range(self.qubit_count)]
 
     def get_index(self, position):
         """ Convert a 2D (x, y) coordinate into a 1D array index.
@@ -55,28 +47,69 @@ class QuantumState:
         y = max(0, min(self.size - 1, position[1]))
         return y * self.size + x
 
-    def __append_command(self, command):
-        """Append a string containing qasm commands to the accumulated qasm code."""
-        self.qasm += re.sub(r"^[\t ]+", '', command.strip(), flags=re.M) + '\n\n'
-
-    def __execute(self):
-        self.reset()
-        self.__append_command(self.__setup())
-
+    def __circuit(self):
+        """Return the gates of the setup followed by every queued command"""
+        gates = self.__setup()
         for command in self.command_queue:
-            next_line = ""
             if command["id"] == "move":
-                next_line = self.__move(*command["data"])
+                gates.extend(self.__move(*command["data"]))
             elif command["id"] == "entangle":
-                next_line = self.__entangle(*command["data"])
+                gates.extend(self.__entangle(*command["data"]))
             elif command["id"] == "swap":
-                next_line = self.__swap(*command["data"])
+                gates.extend(self.__swap(*command["data"]))
             elif command["id"] == "measure":
-                next_line = self.__measure(*command["data"])
+                gates.extend(self.__measure(*command["data"]))
             else:
                 print(f"Unknown command {command['id']}")
+        return gates
+
+    def dump_qasm(self):
+        """Return the cQASM program which the queued commands would execute"""
+        return to_qasm(self.__circuit(), self.qubit_count)
+
+    def snapshot(self):
+        """ Return a snapshot which restore can return to.
+
+        The state itself is not copied: moves only add to the pending gates, and the state
+        is copied on the first measurement which would change it while it is shared.
+        """
+        self.shared = self.state is not None
+        return {
+            "state": self.state,
+            "pending": list(self.pending),
+            "command_queue": list(self.command_queue),
+            "initial_states": list(self.initial_states)
+        }
+
+    def restore(self, snapshot):
+        """Return to a snapshot, which can be restored again later"""
+        self.state = snapshot["state"]
+        self.shared = self.state is not None
+        self.pending = list(snapshot["pending"])
+        self.command_queue = list(snapshot["command_queue"])
+        self.initial_states = list(snapshot["initial_states"])
+
+    def flush(self):
+        """Apply the fused gates of all moves since the last measurement to the state"""
+        if self.shared:
+            self.state = self.state.copy()
+            self.shared = False
+        self.state.run(optimize(self.pending))
+        self.pending = []
+
+    def marginals(self):
+        """ Return the probability of every qubit to be in the |1> state.
+
+        Backends which hold a state include the moves since the last measurement, others
+        return the probabilities found by the last measurement.
+        """
+        if self.state is None:
+            return list(self.initial_states)
+        self.flush()
+        return self.state.marginals().tolist()
 
-            self.__append_command(next_line)
+    def __execute(self):
+        gates = optimize(self.__circuit(), unitaries=False)
 
         measured_qubits = self.command_queue[-1]["data"][0]
         self.command_queue = [
@@ -86,35 +119,18 @@ class QuantumState:
             not (command["data"][0] in measured_qubits or command["data"][1] in measured_qubits)
         ] # Filter all commands that are do not entangle unmeasured qubits
 
-        result = qi_api.execute_qasm(qasm=self.qasm, backend_type=qi_backend, number_of_shots=512,
-                                     full_state_projection=True)
+        result = self.backend.marginals(gates, self.qubit_count)
 
         if len(result["raw_text"]) > 0:  # Error handling, raw_text only contains text when an error has occured
             print(result["raw_text"])
-            lines = self.qasm.splitlines()
+            lines = to_qasm(gates, self.qubit_count).splitlines()
             log10_linecount = int(np.floor(np.log10(len(lines)))) + 1
             qasm = "\n".join(
                 [f"{str(index + 1).rjust(log10_linecount, ' ')} |  {line}" for index, line in enumerate(lines)])
             print(f"\nIn QASM Code\n\n{qasm}")
             return
 
-        filtered_probs = {}
-        for key, value in result["histogram"].items():
-            filtered_probs[f"{int(key):b}".zfill(self.qubit_count)[::-1]] = value
-
-        """Renormalizing all the probabilites, and storing them in self.intial_states (array)"""
-
-        inv_normalisation = sum(filtered_probs.values())
-        for key in filtered_probs:
-            filtered_probs[key] = filtered_probs[key] / inv_normalisation
-
-        self.initial_states = []
-        for i in range(self.qubit_count):
-            prob = 0
-            for key in filtered_probs:
-                prob += int(key[i]) * filtered_probs[key]
-            self.initial_states.append(prob)
-
+        self.initial_states = result["marginals"].tolist()
         return self.initial_states
 
     def measure(self, q):
@@ -123,6 +139,12 @@ class QuantumState:
         Args:
             q (int[]): Which qubits are to be measured (values from 0 to 8)
         """
+        if self.state is not None:
+            self.flush()
+            self.state.measure(q)
+            self.initial_states = self.state.marginals().tolist()
+            return self.initial_states
+
         self.command_queue.append({
             "id": "measure",
             "data": [q]
@@ -130,7 +152,7 @@ class QuantumState:
         return self.__execute()
 
     def __measure(self, q):
-        return f"Measure_z q[{', '.join([str(x) for x in q])}]"
+        return [Gate("measure_z", tuple(q), None)]
 
     def move(self, q, player_id):
         """ Classic move: rotation about the y-axis.
@@ -139,6 +161,10 @@ class QuantumState:
             q (int): Which qubit is rotated (value from 0 to 8)
             player_id (int): Which player did the move (value either 1 or 2)
         """
+        if self.state is not None:
+            self.pending.extend(self.__move(q, player_id))
+            return
+
         self.command_queue.append({
             "id": "move",
             "data": [q, player_id]
@@ -149,7 +175,7 @@ class QuantumState:
         if player_id == 1:
             angle = np.pi / 4
 
-        return f"Ry q[{q}], {angle:.10f}"
+        return [Gate("ry", (q,), angle)]
 
     def entangle(self, q1, q2):
         """ Entangle move: entangling two qubits.
@@ -158,25 +184,17 @@ class QuantumState:
             q1, q2 (int): The qubits which need to be entangled (value from 0 to 8)
             engine: Engine is needed for Dagger(engine)
         """
+        if self.state is not None:
+            self.pending.extend(self.__entangle(q1, q2))
+            return
+
         self.command_queue.append({
             "id": "entangle",
             "data": [q1, q2]
         })
 
     def __entangle(self, q1, q2):
-        return f"""
-        CNOT q[{q1}], q[{q2}]
-        {{ H q[{q1}] | Tdag q[{q2}] }}
-        {{ T q[{q1}] | H    q[{q2}] }}
-        H q[{q1}]
-
-        CNOT q[{q1}], q[{q2}]
-        {{ H q[{q1}] | H q[{q2}] }}
-        Tdag q[{q1}]
-        H    q[{q1}]
-        CNOT q[{q1}], q[{q2}]
-        {{ Sdag q[{q1}] | S q[{q2}] }}
-        """
+        return [Gate("entangle", (q1, q2))]
 
     def swap(self, q1, q2):
         """ Swap move: swapping two qubits.
@@ -184,10 +202,98 @@ class QuantumState:
             qubits: The qubits
             q1, q2 (int): The qubits which need to be swapped (value from 0 to 8)
         """
+        if self.state is not None:
+            self.pending.extend(self.__swap(q1, q2))
+            return
+
         self.command_queue.append({
             "id": "swap",
             "data": [q1, q2]
         })
 
     def __swap(self, q1, q2):
-        return f"swap q[{q1}], q[{q2}]"
\ No newline at end of file
+        return [Gate("swap", (q1, q2), None)]
+
+
+class QuantumStateBatch:
+    "Quantum states of many games of the same size, simulated side by side on one batch of statevectors"
+
+    def __init__(self, batch_size, size=3, seed=None):
+        """ Create batch_size quantum states and perform the setup of every one of them.
+
+        The moves take one qubit index per game, -1 for the games which do not take part, and
+        apply the gate to all games using the same qubits at once.
+
+        Args:
+            batch_size (int): The number of games
+            size (int): The width and height of the boards
+            seed (int): Seed for the random number generator used by measurements
+        """
+        self.batch_size = batch_size
+        self.size = size
+        self.qubit_count = self.size ** 2
+        self.simulator = BatchStatevectorSimulator(batch_size, self.qubit_count, np.random.default_rng(seed))
+        everyone = np.ones(batch_size, dtype=bool)
+        for q in range(self.qubit_count):
+            self.__gate("ry", np.full((batch_size, 1), q), everyone, np.pi * 0.5)
+
+    def __gate(self, name, qubits, mask, angle=None):
+        """ Apply a gate to the games in mask, grouped by the qubits it acts on.
+
+        Args:
+            qubits (np.ndarray): One row of qubits per game
+            mask (bool[]): The games the gate is applied to
+        """
+        rows = np.flatnonzero(mask)
+        if rows.size == 0:
+            return
+
+        groups, inverse = np.unique(qubits[rows], axis=0, return_inverse=True)
+        for group, group_qubits in enumerate(groups):
+            matrix, targets, controls = gate_operation(name, tuple(group_qubits.tolist()), angle)
+            members = rows[inverse.ravel() == group]
+            matrices = np.broadcast_to(matrix, (len(members),) + matrix.shape)
+            self.simulator.apply(matrices, targets, controls, members if len(members) < self.batch_size else None)
+
+    def marginals(self):
+        """Return the probability of every qubit to be in the |1> state, one row per game"""
+        return self.simulator.marginals()
+
+    def measure(self, qubits):
+        """ Measure move: collapse qubits of every game
+
+        Args:
+            qubits (int[][]): Which qubits are to be measured per game, empty for games which do not measure
+        """
+        for k in range(max((len(q) for q in qubits), default=0)):
+            column = np.array([q[k] if k < len(q) else -1 for q in qubits])
+            for q in np.unique(column[column >= 0]):
+                self.simulator.measure(int(q), np.flatnonzero(column == q))
+        return self.marginals()
+
+    def move(self, qubits, player_ids):
+        """ Classic move: rotation about the y-axis.
+        Args:
+            qubits (int[]): Which qubit is rotated per game, -1 for no move
+            player_ids (int[]): Which player did the move per game (values either 1 or 2), or one for all games
+        """
+        qubits = np.asarray(qubits)
+        player_ids = np.broadcast_to(player_ids, qubits.shape)
+        for player_id, angle in ((1, np.pi / 4), (2, -np.pi / 4)):
+            self.__gate("ry", qubits[:, None], (qubits >= 0) & (player_ids == player_id), angle)
+
+    def entangle(self, q1, q2):
+        """ Entangle move: entangling two qubits per game.
+        Args:
+            q1, q2 (int[]): The qubits which need to be entangled per game, -1 for no move
+        """
+        q1, q2 = np.asarray(q1), np.asarray(q2)
+        self.__gate("entangle", np.stack([q1, q2], axis=1), q1 >= 0)
+
+    def swap(self, q1, q2):
+        """ Swap move: swapping two qubits per game.
+        Args:
+            q1, q2 (int[]): The qubits which need to be swapped per game, -1 for no move
+        """
+        q1, q2 = np.asarray(q1), np.asarray(q2)
+        self.__gate("swap", np.stack([q1, q2], axis=1), q1 >= 0)
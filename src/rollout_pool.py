@@ -0,0 +1,268 @@
+""" Process pool which plays out batches of quantum game positions in parallel.
+
+Positions are written as fixed size records into a shared memory buffer, so a batch costs no
+pickling. A record holds the classical board, the entangled groups, the counters of the game
+and the quantum state: the amplitudes of the components of a factored state when they fit in
+MAX_AMPLITUDES, which they always do on a 3x3 board. Other states are shipped as the marginal
+probabilities of the qubits, which workers prepare unentangled, so collapses within a group
+are no longer correlated.
+
+Every worker starts on its own share of the batch and steals from the back of the largest
+remaining share once it runs out, and no rollout is started after the deadline of the batch.
+"""
+import os
+import time
+from multiprocessing import Lock, Pipe, Process
+
+import numpy as np
+
+from Board import Board
+from simulator import FactoredState
+
+MAX_AMPLITUDES = 2 ** 9
+
+
+def record_dtype(size):
+    """Return the record layout of a position on a size x size board"""
+    n = size * size
+    return np.dtype([
+        ("probabilities", np.float64, n),
+        ("marginals", np.float64, n),
+        ("component_qubits", np.int16, n),  # the qubits of the components one after another
+        ("component_sizes", np.int16, n),  # the number of qubits per component, all 0 to use the marginals
+        ("amplitudes", np.complex128, min(2 ** n, MAX_AMPLITUDES)),  # the amplitudes of the components
+        ("states", np.int8, n),
+        ("labels", np.int32, n),
+        ("player", np.int8),
+        ("moves_left", np.int16),
+        ("swaps_left", np.int16, 2),
+        ("score", np.float64),  # summed score of X over the rollouts played so far
+        ("count", np.int32)
+    ])
+
+
+def encode(board, record):
+    """Write a board into a record and clear its results"""
+    record["probabilities"] = board.probabilities
+    record["marginals"] = board.qs.marginals()
+    record["component_sizes"] = 0
+
+    state = board.qs.state
+    if isinstance(state, FactoredState):
+        parts = state.split()
+        if sum(len(amplitudes) for _, amplitudes in parts) <= len(record["amplitudes"]):
+            start = 0
+            for i, (qubits, amplitudes) in enumerate(parts):
+                record["amplitudes"][start:start + len(amplitudes)] = amplitudes
+                start += len(amplitudes)
+                record["component_sizes"][i] = len(qubits)
+            record["component_qubits"] = [q for qubits, _ in parts for q in qubits]
+    record["states"] = board.states
+    record["labels"] = board.labels()
+    record["player"] = board.player
+    record["moves_left"] = board.moves_left
+    record["swaps_left"] = board.swaps_left
+    record["score"] = 0
+    record["count"] = 0
+
+
+def decode(record, size):
+    """Return a new local board in the position of a record"""
+    board = Board(size)
+    board.verbose = False
+
+    qs = board.qs
+    qs.initial_states = record["marginals"].tolist()
+    if record["component_sizes"].any():
+        parts = []
+        qubit, amplitude = 0, 0
+        for component_size in record["component_sizes"][record["component_sizes"] > 0].tolist():
+            parts.append((record["component_qubits"][qubit:qubit + component_size].tolist(),
+                          record["amplitudes"][amplitude:amplitude + 2 ** component_size]))
+            qubit += component_size
+            amplitude += 2 ** component_size
+        qs.state = FactoredState.join(parts, qs.qubit_count, qs.backend.rng)
+    else:
+        qs.state = FactoredState(qs.qubit_count, qs.backend.rng)
+        for q, probability in enumerate(qs.initial_states):
+            qs.state.gate("ry", [q], 2 * np.arcsin(np.sqrt(probability)))
+
+    labels = record["labels"].astype(int)
+    board.restore({
+        "probabilities": record["probabilities"],
+        "states": record["states"],
+        "parent": labels,
+        "group_size": np.bincount(labels, minlength=labels.size),
+        "player": int(record["player"]),
+        "moves_left": int(record["moves_left"]),
+        "swaps_left": record["swaps_left"].tolist(),
+        "quantum_state": qs.snapshot()
+    })
+    return board
+
+
+def rollout(board, rng):
+    """ Play random actions until the game ends.
+
+    The kind of action is drawn first, so the many swap and entangle pairs do not crowd
+    out moves and collapses.
+    """
+    while not board.is_over():
+        kinds = {}
+        for action in board.legal_actions():
+            kinds.setdefault(action[0], []).append(action)
+        actions = list(kinds.values())[rng.integers(len(kinds))]
+        board.play(actions[rng.integers(len(actions))])
+
+
+def x_score(board):
+    """Return 1 if X won the finished game on the board, 0 if O won and 0.5 for a tie"""
+    wins = board.check_win()
+    if len(wins) != 1:
+        return 0.5
+    return 1.0 if "X" in wins else 0.0
+
+
+def _next_task(bounds, index, lock):
+    """Take a record from the front of the own share, or steal one from the back of the largest share"""
+    with lock:
+        if bounds[index, 0] < bounds[index, 1]:
+            bounds[index, 0] += 1
+            return bounds[index, 0] - 1
+
+        victim = int(np.argmax(bounds[:, 1] - bounds[:, 0]))
+        if bounds[victim, 0] < bounds[victim, 1]:
+            bounds[victim, 1] -= 1
+            return bounds[victim, 1]
+    return None
+
+
+def _worker(index, size, capacity, workers, records_name, bounds_name, lock, connection, seed):
+    from multiprocessing.shared_memory import SharedMemory
+
+    dtype = record_dtype(size)
+    records_memory = SharedMemory(name=records_name)
+    bounds_memory = SharedMemory(name=bounds_name)
+    records = np.ndarray(capacity, dtype=dtype, buffer=records_memory.buf)
+    bounds = np.ndarray((workers, 2), dtype=np.int64, buffer=bounds_memory.buf)
+    rng = np.random.default_rng(seed)
+
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+
+        rollouts, deadline = message
+        while time.time() < deadline:
+            task = _next_task(bounds, index, lock)
+            if task is None:
+                break
+            record = records[task]
+            for _ in range(rollouts):
+                if time.time() >= deadline:
+                    break
+                board = decode(record, size)
+                rollout(board, rng)
+                record["score"] += x_score(board)
+                record["count"] += 1
+        connection.send(index)
+
+    del records, bounds
+    records_memory.close()
+    bounds_memory.close()
+
+
+class RolloutPool:
+    "Pool of worker processes which play out positions written to shared memory"
+
+    def __init__(self, workers=None, size=3, capacity=256, seed=None):
+        """ Start the worker processes.
+
+        Args:
+            workers (int): The number of processes, None for every core
+            size (int): The width and height of the boards
+            capacity (int): The number of positions which fit in one batch
+            seed (int): Seed from which the random number generators of the workers are derived
+        """
+        # Imported here, so the game and single process search also run on Python 3.7
+        from multiprocessing.shared_memory import SharedMemory
+
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.size = size
+        self.capacity = capacity
+
+        dtype = record_dtype(size)
+        self.records_memory = SharedMemory(create=True, size=capacity * dtype.itemsize)
+        self.bounds_memory = SharedMemory(create=True, size=self.workers * 2 * 8)
+        self.records = np.ndarray(capacity, dtype=dtype, buffer=self.records_memory.buf)
+        self.bounds = np.ndarray((self.workers, 2), dtype=np.int64, buffer=self.bounds_memory.buf)
+        self.lock = Lock()
+
+        seeds = np.random.SeedSequence(seed).spawn(self.workers)
+        self.connections = []
+        self.processes = []
+        for index in range(self.workers):
+            parent, child = Pipe()
+            process = Process(target=_worker, daemon=True, args=(
+                index, size, capacity, self.workers, self.records_memory.name, self.bounds_memory.name,
+                self.lock, child, seeds[index]))
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+    def evaluate(self, boards, rollouts=1, deadline=None):
+        """ Play out every board and return the mean score of X for each of them.
+
+        Args:
+            boards (Board[]): The positions, which are not changed
+            rollouts (int): The number of rollouts per position
+            deadline (float): time.time() after which no rollout is started, None to play all of them
+
+        Returns:
+            np.ndarray: The mean score per board (1 for an X win, 0.5 for a tie), NaN for boards
+                        which were not played out before the deadline
+        """
+        if deadline is None:
+            deadline = float("inf")
+
+        scores = np.full(len(boards), np.nan)
+        for start in range(0, len(boards), self.capacity):
+            batch = boards[start:start + self.capacity]
+            for record, board in zip(self.records, batch):
+                encode(board, record)
+
+            # Split the batch into contiguous shares, one per worker
+            edges = np.linspace(0, len(batch), self.workers + 1).astype(np.int64)
+            self.bounds[:, 0], self.bounds[:, 1] = edges[:-1], edges[1:]
+
+            for connection in self.connections:
+                connection.send((rollouts, deadline))
+            for connection in self.connections:
+                connection.recv()
+
+            counts = self.records["count"][:len(batch)]
+            played = counts > 0
+            scores[start:start + len(batch)][played] = self.records["score"][:len(batch)][played] / counts[played]
+
+            if time.time() >= deadline:
+                break
+        return scores
+
+    def close(self):
+        """Stop the workers and free the shared memory"""
+        for connection in self.connections:
+            connection.send(None)
+        for process in self.processes:
+            process.join()
+
+        del self.records, self.bounds
+        self.records_memory.close()
+        self.records_memory.unlink()
+        self.bounds_memory.close()
+        self.bounds_memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,293 @@
+""" Headless asyncio game server hosting many games in one process.
+
+Every session owns its own Board (quantum game) or board state (classical game against the
+QuantumBot). The JSON over HTTP api is
+
+    POST   /games                  {"game": "quantum" | "classical", "size": 3}  create a session
+    GET    /games/<id>                                                          the state of a session
+    POST   /games/<id>/actions     {"action": "move", "positions": [[0, 1]]}    play an action
+    POST   /games/<id>/bot                                                      let the bot play
+    DELETE /games/<id>                                                          end a session
+
+Classical games take {"square": 4} as action and the bot plays X, moving first; requests out
+of turn are answered with 409. Simulation and search run on a bounded thread pool; when too
+many operations are waiting for it the server answers 503 with a Retry-After header instead
+of queueing without bound.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from Board import Board
+from backends import LocalBackend
+from quantum_bot import WINS_3x3, X, O, _, QuantumBot
+from quantum_search_bot import QuantumSearchBot
+
+MAX_BODY = 64 * 1024
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    "Error which is sent to the client with its status code"
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Session:
+    "One game, its bot and the lock which lets one operation at a time change it"
+
+    def __init__(self, game, size, time_budget):
+        self.id = uuid.uuid4().hex
+        self.game = game
+        self.lock = None  # set on the event loop thread, sessions are built on the executor
+        self.last_used = time.monotonic()
+
+        if game == "quantum":
+            self.board = Board(size)
+            self.board.verbose = False
+            self.bot = QuantumSearchBot(time_budget)
+        elif game == "classical":
+            self.board = [_] * 9
+            self.turn = 1
+            self.player = X  # the bot plays X and moves first
+            self.bot = QuantumBot(backend=LocalBackend())
+        else:
+            raise HTTPError(400, f"Unknown game {game}")
+
+    def winner(self):
+        """Return "X", "O" or "draw" once the game is over, None while it is being played"""
+        if self.game == "quantum":
+            if not self.board.is_over():
+                return None
+            wins = self.board.check_win()
+            return wins.pop() if len(wins) == 1 else "draw"
+
+        for a, b, c in WINS_3x3:
+            if self.board[a] != _ and self.board[a] == self.board[b] == self.board[c]:
+                return "X" if self.board[a] == X else "O"
+        return "draw" if _ not in self.board else None
+
+    def state(self):
+        """Return the state of the game as sent to the client"""
+        if self.game == "classical":
+            return {"id": self.id, "game": self.game, "player": ".XO"[self.player],
+                    "squares": [".XO"[value] for value in self.board], "winner": self.winner()}
+
+        board = self.board
+        return {
+            "id": self.id,
+            "game": self.game,
+            "size": board.size,
+            "player": "X" if board.player == 1 else "O",
+            "moves_left": board.moves_left,
+            "swaps_left": board.swaps_left,
+            "probabilities": board.probabilities.tolist(),
+            "squares": [board.get_symbol(divmod(i, board.size)) for i in range(board.size ** 2)],
+            "groups": board.labels().tolist(),
+            "winner": self.winner()
+        }
+
+    def play(self, request):
+        """Play the action of the player, runs on the executor"""
+        if self.winner() is not None:
+            raise HTTPError(409, "The game is over")
+
+        if self.game == "classical":
+            if self.player != O:
+                raise HTTPError(409, "It is the turn of the bot")
+            square = request.get("square")
+            if not isinstance(square, int) or not 0 <= square < 9 or self.board[square] != _:
+                raise HTTPError(400, f"Square {square} is not free")
+            self.board[square] = O
+            self.player = X
+            return self.state()
+
+        try:
+            action = (request["action"],) + tuple(tuple(position) for position in request["positions"])
+        except (KeyError, TypeError):
+            raise HTTPError(400, 'Expected {"action": name, "positions": [[row, column], ...]}')
+        if action not in self.board.legal_actions():
+            raise HTTPError(400, f"Illegal action {request}")
+        self.board.play(action)
+        return self.state()
+
+    def bot_move(self):
+        """Let the bot play for the player to move, runs on the executor"""
+        if self.winner() is not None:
+            raise HTTPError(409, "The game is over")
+
+        if self.game == "classical":
+            if self.player != X:
+                raise HTTPError(409, "It is the turn of the player")
+            square = self.bot.find_next_move(list(self.board), self.turn)
+            self.board[square] = X
+            self.turn += 1
+            self.player = O
+            return {"square": square, "state": self.state()}
+
+        action = self.bot.find_next_move(self.board)
+        self.board.play(action)
+        return {"action": action[0], "positions": [list(position) for position in action[1:]], "state": self.state()}
+
+
+class GameServer:
+    "Serves the sessions over HTTP, with the simulation on a bounded executor"
+
+    def __init__(self, workers=4, max_pending=64, max_sessions=10000, idle_timeout=3600, time_budget=0.2):
+        """ Create a new server.
+
+        Args:
+            workers (int): Threads simulating and searching
+            max_pending (int): Operations which may wait for or run on the executor before new ones are refused
+            max_sessions (int): The number of sessions which may exist at once
+            idle_timeout (float): Seconds after which an unused session is ended
+            time_budget (float): Seconds of search per move of the quantum game bot
+        """
+        self.executor = ThreadPoolExecutor(workers)
+        self.pending = asyncio.Semaphore(max_pending)
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.time_budget = time_budget
+        self.sessions = {}
+
+    async def run_in_executor(self, function, *args):
+        """Run simulator work on the executor, or refuse it when the executor is saturated"""
+        if self.pending.locked():
+            raise HTTPError(503, "The server is busy")
+        async with self.pending:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def session(self, session_id):
+        if session_id not in self.sessions:
+            raise HTTPError(404, f"No game {session_id}")
+        session = self.sessions[session_id]
+        session.last_used = time.monotonic()
+        return session
+
+    async def route(self, method, path, body):
+        """Handle a request and return the status and the JSON response"""
+        parts = [part for part in path.split("?")[0].split("/") if part]
+        if not parts or parts[0] != "games":
+            raise HTTPError(404, f"Unknown path {path}")
+
+        if len(parts) == 1:
+            if method != "POST":
+                raise HTTPError(405, f"{method} is not allowed on {path}")
+            if len(self.sessions) >= self.max_sessions:
+                raise HTTPError(503, "Too many games")
+            size = body.get("size", 3)
+            if not isinstance(size, int) or not 2 <= size <= 5:
+                raise HTTPError(400, "The size must be between 2 and 5")
+            session = await self.run_in_executor(Session, body.get("game", "quantum"), size, self.time_budget)
+            session.lock = asyncio.Lock()  # before Python 3.10 a lock binds to the loop of the thread creating it
+            self.sessions[session.id] = session
+            return 201, session.state()
+
+        session = self.session(parts[1])
+        if len(parts) == 2 and method == "GET":
+            return 200, session.state()
+        if len(parts) == 2 and method == "DELETE":
+            del self.sessions[session.id]
+            return 200, {"id": session.id}
+        if len(parts) == 3 and method == "POST" and parts[2] in ("actions", "bot"):
+            async with session.lock:
+                if parts[2] == "actions":
+                    return 200, await self.run_in_executor(session.play, body)
+                return 200, await self.run_in_executor(session.bot_move)
+        raise HTTPError(405, f"{method} is not allowed on {path}")
+
+    async def handle(self, reader, writer):
+        """Serve the requests of one connection, which is kept alive until the client closes it"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, separator, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get("content-length", 0))
+                    if length > MAX_BODY:
+                        raise HTTPError(413, "The request body is too large")
+                    body = json.loads(await reader.readexactly(length)) if length else {}
+                    if not isinstance(body, dict):
+                        raise HTTPError(400, "The request body must be a JSON object")
+                    status, response = await self.route(method, path, body)
+                except HTTPError as error:
+                    status, response = error.status, {"error": str(error)}
+                except (ValueError, UnicodeDecodeError):
+                    status, response = 400, {"error": "The request body is not valid JSON"}
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                payload = json.dumps(response).encode()
+                head = [f"HTTP/1.1 {status} {REASONS[status]}", "Content-Type: application/json",
+                        f"Content-Length: {len(payload)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+                if status == 503:
+                    head.append("Retry-After: 1")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def expire_sessions(self):
+        """End the sessions which have not been used for idle_timeout seconds"""
+        while True:
+            await asyncio.sleep(min(60, self.idle_timeout))
+            now = time.monotonic()
+            for session_id, session in list(self.sessions.items()):
+                if now - session.last_used > self.idle_timeout and not session.lock.locked():
+                    del self.sessions[session_id]
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving games on http://{host}:{port}")
+        expiry = asyncio.create_task(self.expire_sessions())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            expiry.cancel()
+            self.executor.shutdown(wait=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve quantum and classical tic tac toe games over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=4, help="threads simulating and searching")
+    parser.add_argument("--max-pending", type=int, default=64, help="operations queued before requests are refused")
+    parser.add_argument("--max-sessions", type=int, default=10000, help="games which may exist at once")
+    parser.add_argument("--idle-timeout", type=float, default=3600, help="seconds after which an unused game ends")
+    parser.add_argument("--time-budget", type=float, default=0.2, help="seconds of search per bot move")
+    args = parser.parse_args(argv)
+
+    async def serve():
+        server = GameServer(args.workers, args.max_pending, args.max_sessions, args.idle_timeout, args.time_budget)
+        await server.serve(args.host, args.port)
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,476 @@
+import copy
+
+import numpy as np
+
+from circuit import CONTROLLED_GATES, ENTANGLE_MATRIX, GATES, ROTATIONS, Gate, parse_qasm
+
+
+def gate_operation(name, qubits, angle=None):
+    """ Return the unitary, targets and controls of a gate by its (case insensitive) cQASM name.
+
+    Args:
+        name (str): The gate name, e.g. "H", "Ry" or "CNOT"
+        qubits (int[]): The qubits the gate acts on, controls first
+        angle (float): The rotation angle for rotation gates
+    """
+    name = name.lower()
+    if name in ROTATIONS:
+        return ROTATIONS[name](angle), qubits, ()
+    elif name in CONTROLLED_GATES:
+        control_count, target = CONTROLLED_GATES[name]
+        return GATES[target], qubits[control_count:], qubits[:control_count]
+    elif name in GATES:
+        return GATES[name], qubits, ()
+    elif name == "entangle":
+        return ENTANGLE_MATRIX, qubits, ()
+    raise ValueError(f"Unknown gate {name}")
+
+
+def split_gates(gates):
+    """ Yield the gates of a circuit one application at a time.
+
+    Gates listed with several qubits, e.g. "h q[0:2]" or "cnot q[0, 1, 2, 3]", are applied to
+    every qubit or group of qubits in turn; unitaries and measurements are passed on whole.
+    """
+    for gate in gates:
+        name, qubits, angle, matrix = gate
+        if name == "unitary" or name in ("measure_z", "measure"):
+            yield gate
+        elif name in CONTROLLED_GATES or name in ("swap", "entangle"):
+            arity = CONTROLLED_GATES[name][0] + 1 if name in CONTROLLED_GATES else 2
+            for i in range(0, len(qubits), arity):
+                yield Gate(name, qubits[i:i + arity], angle, matrix)
+        else:
+            for q in qubits:
+                yield Gate(name, (q,), angle, matrix)
+
+
+def qubit_bits(qubit_count):
+    """Return the matrix holding bit q of basis state i at [i, q]"""
+    return (np.arange(2 ** qubit_count)[:, None] >> np.arange(qubit_count)) & 1
+
+
+def snap_collapsed(marginals):
+    """Set marginals within rounding errors of 0 or 1 to exactly 0 or 1, as collapsed qubits are"""
+    marginals[np.isclose(marginals, 1, rtol=0, atol=1e-9)] = 1
+    marginals[np.isclose(marginals, 0, rtol=0, atol=1e-9)] = 0
+    return marginals
+
+
+class Simulator:
+    "Base class of the in-process simulators, which implement apply, measure and marginals"
+
+    def gate(self, name, qubits, angle=None):
+        """Apply a gate by its (case insensitive) cQASM name, see gate_operation"""
+        self.apply(*gate_operation(name, qubits, angle))
+
+    def run_qasm(self, qasm, collapse=True):
+        """Apply the gates of a cQASM program to the state, see run"""
+        self.run(parse_qasm(qasm), collapse)
+
+    def run(self, gates, collapse=True):
+        """ Apply a list of gates to the state.
+
+        Args:
+            gates (Gate[]): The gates
+            collapse (bool): Whether measurements collapse the state; when False they
+                             are deferred and only recorded in self.measured
+        """
+        for name, qubits, angle, matrix in split_gates(gates):
+            if name == "unitary":
+                self.apply(matrix, qubits)
+            elif name in ("measure_z", "measure"):
+                if collapse:
+                    self.measure(qubits)
+                else:
+                    self.measured.extend(qubits)
+            else:
+                self.gate(name, qubits, angle)
+
+    def copy(self):
+        """Return an independent copy of the state which shares the random number generator"""
+        return copy.deepcopy(self, {id(self.rng): self.rng})
+
+
+class StatevectorSimulator(Simulator):
+    "In-process statevector simulator for the cQASM subset used by the game and the bot"
+
+    def __init__(self, qubit_count, rng=None):
+        """ Create a new simulator with all qubits in the |0> state.
+
+        Qubit i corresponds to bit i of the statevector index, which is the same
+        convention Quantum Inspire uses for the keys of its histograms.
+
+        Args:
+            qubit_count (int): The number of qubits
+            rng (np.random.Generator): Random number generator used for measurements
+        """
+        self.qubit_count = qubit_count
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.amplitudes = np.zeros(2 ** qubit_count, dtype=complex)
+        self.amplitudes[0] = 1
+        self.measured = []
+
+    def __axis(self, q):
+        """Return the tensor axis belonging to qubit q"""
+        return self.qubit_count - 1 - q
+
+    def apply(self, matrix, targets, controls=()):
+        """ Apply a (controlled) unitary to the state.
+
+        Args:
+            matrix (np.ndarray): A 2^k x 2^k unitary, targets[0] being the most significant qubit
+            targets (int[]): The k qubits the unitary acts on
+            controls (int[]): Qubits which all need to be |1> for the unitary to be applied
+        """
+        if len(set(targets) | set(controls)) != len(targets) + len(controls):
+            raise ValueError(f"Gate qubits must be distinct, got targets {targets} and controls {controls}")
+
+        n = self.qubit_count
+        k = len(targets)
+        index = [slice(None)] * n
+        for c in controls:
+            index[self.__axis(c)] = 1
+        sub = self.amplitudes.reshape((2,) * n)[tuple(index)]
+
+        # Axes of the targets once the control axes have been indexed away
+        axes = [self.__axis(t) - sum(c > t for c in controls) for t in targets]
+        if k == 1:
+            # Update both halves in place, which avoids the copies of tensordot and moveaxis
+            zero = [slice(None)] * sub.ndim
+            one = list(zero)
+            zero[axes[0]], one[axes[0]] = 0, 1
+            zero, one = tuple(zero), tuple(one)
+            a0 = sub[zero].copy()
+            a1 = sub[one]
+            sub[zero] = matrix[0, 0] * a0 + matrix[0, 1] * a1
+            sub[one] = matrix[1, 0] * a0 + matrix[1, 1] * a1
+            return
+
+        result = np.tensordot(matrix.reshape((2,) * (2 * k)), sub, axes=(list(range(k, 2 * k)), axes))
+        sub[...] = np.moveaxis(result, list(range(k)), axes)
+
+    def measure(self, qubits):
+        """ Measure qubits in the z-basis, collapsing the state.
+
+        Args:
+            qubits (int[]): The qubits to measure
+
+        Returns:
+            int[]: The measurement outcome of every qubit
+        """
+        outcomes = []
+        state = self.amplitudes.reshape((2,) * self.qubit_count)
+        for q in qubits:
+            axis = self.__axis(q)
+            one = np.take(state, 1, axis=axis)
+            p1 = np.vdot(one, one).real / np.vdot(state, state).real
+            outcome = int(self.rng.random() < p1)
+
+            index = [slice(None)] * self.qubit_count
+            index[axis] = 1 - outcome
+            state[tuple(index)] = 0
+            state /= np.linalg.norm(self.amplitudes)
+            outcomes.append(outcome)
+            self.measured.append(q)
+        return outcomes
+
+    def probabilities(self):
+        """Return the probability of every basis state"""
+        return np.abs(self.amplitudes) ** 2
+
+    def marginals(self):
+        """ Return the exact probability of every qubit to be in the |1> state.
+
+        Qubits that have collapsed give exactly 0 or 1.
+        """
+        probabilities = self.probabilities()
+        return snap_collapsed(probabilities @ qubit_bits(self.qubit_count) / probabilities.sum())
+
+
+class BatchStatevectorSimulator:
+    "Statevector simulator which runs several circuits side by side on a batch of statevectors"
+
+    def __init__(self, batch_size, qubit_count, rng=None):
+        """ Create batch_size statevectors with all qubits in the |0> state.
+
+        Args:
+            batch_size (int): The number of circuits run side by side
+            qubit_count (int): The number of qubits of every statevector
+            rng (np.random.Generator): Random number generator, kept for the backends sampling from the batch
+        """
+        self.batch_size = batch_size
+        self.qubit_count = qubit_count
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.amplitudes = np.zeros((batch_size, 2 ** qubit_count), dtype=complex)
+        self.amplitudes[:, 0] = 1
+        self.measured = [[] for _ in range(batch_size)]
+
+    def __axis(self, q):
+        """Return the tensor axis belonging to qubit q, axis 0 being the batch"""
+        return self.qubit_count - q
+
+    def apply(self, matrices, targets, controls=(), rows=None):
+        """ Apply a (controlled) unitary per statevector to the same qubits of several statevectors.
+
+        Args:
+            matrices (np.ndarray): One 2^k x 2^k unitary per row, targets[0] being the most significant qubit
+            targets (int[]): The k qubits the unitaries act on
+            controls (int[]): Qubits which all need to be |1> for the unitaries to be applied
+            rows (int[]): The statevectors to apply the unitaries to in ascending order, None for all of them
+        """
+        if len(set(targets) | set(controls)) != len(targets) + len(controls):
+            raise ValueError(f"Gate qubits must be distinct, got targets {targets} and controls {controls}")
+
+        state = self.amplitudes.reshape((self.batch_size,) + (2,) * self.qubit_count)
+        if rows is None:
+            self.__apply(state, matrices, targets, controls)
+            return
+
+        rows = np.asarray(rows)
+        if np.count_nonzero(np.diff(rows) != 1) >= 4 and (matrices == matrices[0]).all():
+            # Scattered rows sharing a unitary are cheaper to copy out, update at once and write back
+            sub = state[rows]
+            self.__apply(sub, matrices, targets, controls)
+            state[rows] = sub
+            return
+
+        # Slices keep the statevectors views, so every run of consecutive rows is updated in place
+        start = 0
+        for i in range(1, len(rows) + 1):
+            if i == len(rows) or rows[i] != rows[i - 1] + 1:
+                self.__apply(state[rows[start]:rows[i - 1] + 1], matrices[start:i], targets, controls)
+                start = i
+
+    def __apply(self, state, matrices, targets, controls):
+        """Apply one unitary per statevector to a view of consecutive statevectors"""
+        index = [slice(None)] * state.ndim
+        for c in controls:
+            index[self.__axis(c)] = 1
+        sub = state[tuple(index)]
+        axes = [self.__axis(t) - sum(c > t for c in controls) for t in targets]
+
+        if (matrices == matrices[0]).all():
+            # The same unitary for every row is a single update of the whole view
+            self.__apply_matrix(sub, matrices[0], axes)
+        else:
+            for row, matrix in enumerate(matrices):
+                self.__apply_matrix(sub[row], matrix, [axis - 1 for axis in axes])
+
+    @staticmethod
+    def __apply_matrix(sub, matrix, axes):
+        """Apply a unitary to the given axes of a view, in place"""
+        k = len(axes)
+        if k == 1:
+            # Update both halves in place, as StatevectorSimulator does
+            zero = [slice(None)] * sub.ndim
+            one = list(zero)
+            zero[axes[0]], one[axes[0]] = 0, 1
+            zero, one = tuple(zero), tuple(one)
+            a0 = sub[zero].copy()
+            a1 = sub[one]
+            sub[zero] = matrix[0, 0] * a0 + matrix[0, 1] * a1
+            sub[one] = matrix[1, 0] * a0 + matrix[1, 1] * a1
+            return
+
+        result = np.tensordot(matrix.reshape((2,) * (2 * k)), sub, axes=(list(range(k, 2 * k)), axes))
+        sub[...] = np.moveaxis(result, list(range(k)), axes)
+
+    def run(self, circuits):
+        """ Run one circuit per statevector in lockstep, measurements are deferred to the end.
+
+        At every step the gates of the circuits are grouped by the qubits they act on and every
+        group is applied at once; circuits which are shorter than the others idle at the end.
+
+        Args:
+            circuits (Gate[][]): The circuits, which are recorded in self.measured per row
+        """
+        steps = []
+        for gates in circuits:
+            operations = []
+            for name, qubits, angle, matrix in split_gates(gates):
+                if name == "unitary":
+                    operations.append((matrix, tuple(qubits), ()))
+                elif name in ("measure_z", "measure"):
+                    operations.append((None, tuple(qubits), ()))
+                else:
+                    matrix, targets, controls = gate_operation(name, qubits, angle)
+                    operations.append((matrix, tuple(targets), tuple(controls)))
+            steps.append(operations)
+
+        for t in range(max(len(operations) for operations in steps)):
+            groups = {}
+            for row, operations in enumerate(steps):
+                if t >= len(operations):
+                    continue
+                matrix, targets, controls = operations[t]
+                if matrix is None:
+                    self.measured[row].extend(targets)
+                else:
+                    groups.setdefault((targets, controls), []).append((row, matrix))
+
+            for (targets, controls), members in groups.items():
+                rows = [row for row, _ in members]
+                matrices = np.array([matrix for _, matrix in members])
+                self.apply(matrices, targets, controls, rows if len(rows) < self.batch_size else None)
+
+    def run_qasm(self, programs):
+        """Run one cQASM program per statevector, see run"""
+        self.run([parse_qasm(qasm) for qasm in programs])
+
+    def probabilities(self):
+        """Return the probability of every basis state, one row per statevector"""
+        return np.abs(self.amplitudes) ** 2
+
+    def marginals(self):
+        """Return the probability of every qubit to be in the |1> state per statevector, collapsed qubits give exactly 0 or 1"""
+        probabilities = self.probabilities()
+        return snap_collapsed(probabilities @ qubit_bits(self.qubit_count) / probabilities.sum(axis=1, keepdims=True))
+
+    def measure(self, qubit, rows=None):
+        """ Collapse a qubit of several statevectors, sampling an outcome for every one of them.
+
+        Args:
+            qubit (int): The qubit to measure
+            rows (int[]): The statevectors to measure the qubit of, None for all of them
+
+        Returns:
+            The outcome per row, True for |1>
+        """
+        rows = np.arange(self.batch_size) if rows is None else np.asarray(rows)
+        ones = (np.arange(self.amplitudes.shape[1]) >> qubit) & 1 == 1
+
+        amplitudes = self.amplitudes[rows]
+        weights = np.abs(amplitudes) ** 2
+        outcomes = self.rng.random(len(rows)) < weights[:, ones].sum(axis=1) / weights.sum(axis=1)
+
+        kept = outcomes[:, None] == ones
+        amplitudes[~kept] = 0
+        amplitudes /= np.sqrt((weights * kept).sum(axis=1, keepdims=True))
+        self.amplitudes[rows] = amplitudes
+        return outcomes
+
+
+class FactoredState(Simulator):
+    "Simulator which keeps every group of entangled qubits in its own statevector"
+
+    def __init__(self, qubit_count, rng=None):
+        """ Create a new state with all qubits in the |0> state, each in its own component.
+
+        Components are only merged when a multi-qubit gate acts on qubits of different
+        components, and a measured qubit is split off again, so memory and time scale
+        with the largest entangled group instead of with the number of qubits.
+
+        Args:
+            qubit_count (int): The number of qubits
+            rng (np.random.Generator): Random number generator used for measurements
+        """
+        self.qubit_count = qubit_count
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.components = [self.__new_component([q]) for q in range(qubit_count)]  # component of every qubit
+        self.measured = []
+
+    def __new_component(self, qubits, simulator=None):
+        """Create a component holding the given qubits, local qubit i being qubits[i]"""
+        if simulator is None:
+            simulator = StatevectorSimulator(len(qubits), self.rng)
+        return {"qubits": qubits, "simulator": simulator}
+
+    def __merge(self, qubits):
+        """Merge the components of the given qubits into one and return it"""
+        merged = None
+        for q in qubits:
+            component = self.components[q]
+            if merged is None:
+                merged = component
+            elif component is not merged:
+                simulator = StatevectorSimulator(len(merged["qubits"]) + len(component["qubits"]), self.rng)
+                simulator.amplitudes = np.kron(component["simulator"].amplitudes, merged["simulator"].amplitudes)
+                merged = self.__new_component(merged["qubits"] + component["qubits"], simulator)
+                for local in merged["qubits"]:
+                    self.components[local] = merged
+        return merged
+
+    def apply(self, matrix, targets, controls=()):
+        """ Apply a (controlled) unitary, merging the components involved.
+
+        Args:
+            matrix (np.ndarray): A 2^k x 2^k unitary, targets[0] being the most significant qubit
+            targets (int[]): The k qubits the unitary acts on
+            controls (int[]): Qubits which all need to be |1> for the unitary to be applied
+        """
+        component = self.__merge(list(targets) + list(controls))
+        local = component["qubits"].index
+        component["simulator"].apply(matrix, [local(t) for t in targets], [local(c) for c in controls])
+
+    def gate(self, name, qubits, angle=None):
+        """A swap only relabels the qubits, any other gate is applied as usual"""
+        if name.lower() != "swap":
+            return super().gate(name, qubits, angle)
+
+        q1, q2 = qubits
+        if q1 == q2:
+            raise ValueError(f"Gate qubits must be distinct, got {qubits}")
+        c1, c2 = self.components[q1], self.components[q2]
+        c1["qubits"][c1["qubits"].index(q1)] = None
+        c2["qubits"][c2["qubits"].index(q2)] = q1
+        c1["qubits"][c1["qubits"].index(None)] = q2
+        self.components[q1], self.components[q2] = c2, c1
+
+    def measure(self, qubits):
+        """ Measure qubits in the z-basis, splitting every measured qubit off into its own component.
+
+        Args:
+            qubits (int[]): The qubits to measure
+
+        Returns:
+            int[]: The measurement outcome of every qubit
+        """
+        outcomes = []
+        for q in qubits:
+            component = self.components[q]
+            local = component["qubits"].index(q)
+            outcome = component["simulator"].measure([local])[0]
+            outcomes.append(outcome)
+            self.measured.append(q)
+
+            if len(component["qubits"]) > 1:
+                # The measured qubit is no longer entangled, keep the rest at the measured value of q
+                rest = [other for other in component["qubits"] if other != q]
+                amplitudes = component["simulator"].amplitudes.reshape(-1, 2, 2 ** local)[:, outcome, :]
+                simulator = StatevectorSimulator(len(rest), self.rng)
+                simulator.amplitudes = amplitudes.reshape(-1) / np.linalg.norm(amplitudes)
+                remaining = self.__new_component(rest, simulator)
+                for other in rest:
+                    self.components[other] = remaining
+
+                single = self.__new_component([q])
+                if outcome:
+                    single["simulator"].gate("x", [0])
+                self.components[q] = single
+        return outcomes
+
+    def marginals(self):
+        """Return the exact probability of every qubit to be in the |1> state"""
+        marginals = np.empty(self.qubit_count)
+        for component in {id(component): component for component in self.components}.values():
+            marginals[component["qubits"]] = component["simulator"].marginals()
+        return marginals
+
+    def split(self):
+        """Return the qubits and the amplitudes of every component, local qubit i being qubits[i]"""
+        return [(list(component["qubits"]), component["simulator"].amplitudes)
+                for component in {id(component): component for component in self.components}.values()]
+
+    @classmethod
+    def join(cls, parts, qubit_count, rng=None):
+        """Create a state from the qubits and the amplitudes of its components, see split"""
+        state = cls(qubit_count, rng)
+        for qubits, amplitudes in parts:
+            simulator = StatevectorSimulator(len(qubits), state.rng)
+            simulator.amplitudes = np.array(amplitudes, dtype=complex)
+            component = state.__new_component(list(qubits), simulator)
+            for q in qubits:
+                state.components[q] = component
+        return state
+
@@ -0,0 +1,99 @@
+""" Glyphs of the States font, which draws the probabilities of the squares of the quantum game. """
+
+
+def qubit_symbol(probability):
+    """Return the glyph of a square which is not entangled, None for a probability without one"""
+    if probability == 1:
+        return "A"
+    elif probability == 0:
+        return "B"
+    elif probability == 0.5:
+        return "C"
+    elif probability == 0.75:
+        return "D"
+    elif probability == 0.25:
+        return "E"
+    return None
+
+
+def group_symbol(probabilities):
+    """Return the glyph of an entangled square, showing the set of probabilities of its group"""
+    if len(probabilities) == 5:
+        return "f"
+
+    elif 1 in probabilities:
+        if 0.75 in probabilities:
+            if 0.5 in probabilities:
+                if 0.25 in probabilities:
+                    return "e"
+                else:
+                    return "b"
+            elif 0.25 in probabilities:
+                if 0 in probabilities:
+                    return "a"
+                else:
+                    return "W"
+            elif 0 in probabilities:
+                return "R"
+            else:
+                return "M"
+        elif 0.5 in probabilities:
+            if 0.25 in probabilities:
+                if 0 in probabilities:
+                    return "c"
+                else:
+                    return "Y"
+            elif 0 in probabilities:
+                return "Q"
+            else:
+                return "K"
+
+        elif 0.25 in probabilities:
+            if 0 in probabilities:
+                return "S"
+            else:
+                return "I"
+        elif 0 in probabilities:
+            return "F"
+        else:
+            return "A"
+
+    elif 0.75 in probabilities:
+        if 0.5 in probabilities:
+            if 0.25 in probabilities:
+                if 0 in probabilities:
+                    return "d"
+                else:
+                    return "X"
+            elif 0 in probabilities:
+                return "Z"
+            else:
+                return "O"
+        elif 0.25 in probabilities:
+            if 0 in probabilities:
+                return "V"
+            else:
+                return "G"
+        elif 0 in probabilities:
+            return "J"
+        else:
+            return "D"
+
+    elif 0.5 in probabilities:
+        if 0.25 in probabilities:
+            if 0 in probabilities:
+                return "T"
+            else:
+                return "P"
+        elif 0 in probabilities:
+            return "L"
+        else:
+            return "H"
+
+    elif 0.25 in probabilities:
+        if 0 in probabilities:
+            return "N"
+        else:
+            return "E"
+    else:
+        return "B"
@@ -0,0 +1,164 @@
+""" Headless self-play runner for the bots, without the Kivy app.
+
+Plays a number of games of classical tic tac toe (QuantumBot) or of the quantum game
+(QuantumSearchBot on a Board) and reports the throughput, the latency of the moves, the
+calls made to the backend and the results as JSON, e.g.
+
+    python tournament.py --game quantum --games 20 --o random --output results.json
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+import qi_client
+from Board import Board
+from backends import LocalBackend, RemoteBackend
+from cache import result_cache
+from quantum_bot import WINS_3x3, X, O, _, QuantumBot
+from quantum_search_bot import QuantumSearchBot
+
+
+def latency_summary(latencies):
+    """Return the number, mean and percentiles of move latencies in seconds"""
+    if not latencies:
+        return {"moves": 0}
+    latencies = np.array(latencies)
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {"moves": len(latencies), "mean": float(latencies.mean()), "p50": float(p50), "p90": float(p90),
+            "p99": float(p99), "max": float(latencies.max())}
+
+
+def classical_winner(board_state):
+    """Return "X" or "O" if a player has a line, "draw" for a full board and None otherwise"""
+    for a, b, c in WINS_3x3:
+        if board_state[a] != _ and board_state[a] == board_state[b] == board_state[c]:
+            return "X" if board_state[a] == X else "O"
+    return "draw" if _ not in board_state else None
+
+
+def play_classical(players, backend, rng, live):
+    """ Play a game of classical tic tac toe in which X moves first.
+
+    A bot playing O is a QuantumBot looking at the board with X and O swapped.
+
+    Returns:
+        The result ("X", "O" or "draw") and the latency of every move per player
+    """
+    bots = {symbol: QuantumBot(live=live, backend=backend) for symbol, kind in players.items() if kind == "bot"}
+    board_state = [_] * 9
+    turns = {"X": 1, "O": 1}
+    latencies = {"X": [], "O": []}
+    symbol = "X"
+
+    while classical_winner(board_state) is None:
+        start = time.perf_counter()
+        if players[symbol] == "random":
+            move = int(rng.choice([i for i, value in enumerate(board_state) if value == _]))
+        else:
+            view = board_state if symbol == "X" else [X if v == O else O if v == X else _ for v in board_state]
+            move = bots[symbol].find_next_move(view, turns[symbol])
+        latencies[symbol].append(time.perf_counter() - start)
+
+        board_state[move] = X if symbol == "X" else O
+        turns[symbol] += 1
+        symbol = "O" if symbol == "X" else "X"
+
+    return classical_winner(board_state), latencies
+
+
+def play_quantum(players, backend, rng, time_budget, workers):
+    """ Play a game of quantum tic tac toe in which X moves first.
+
+    Returns:
+        The result ("X", "O" or "draw") and the latency of every move per player
+    """
+    board = Board(backend=backend)
+    board.verbose = False
+    bots = {symbol: QuantumSearchBot(time_budget, workers, seed=int(rng.integers(2 ** 32)))
+            for symbol, kind in players.items() if kind == "bot"}
+    latencies = {"X": [], "O": []}
+
+    while not board.is_over():
+        symbol = "X" if board.player == 1 else "O"
+        start = time.perf_counter()
+        if players[symbol] == "random":
+            actions = board.legal_actions()
+            action = actions[rng.integers(len(actions))]
+        else:
+            action = bots[symbol].find_next_move(board)
+        latencies[symbol].append(time.perf_counter() - start)
+        board.play(action)
+
+    for bot in bots.values():
+        bot.close()
+
+    wins = board.check_win()
+    return (wins.pop() if len(wins) == 1 else "draw"), latencies
+
+
+def run(args):
+    """Play the games described by the parsed command line arguments and return the report"""
+    rng = np.random.default_rng(args.seed)
+    if args.backend == "local":
+        backend = LocalBackend(seed=args.seed)
+    else:
+        backend = RemoteBackend(qi_client.get_client(), qi_client.get_backend_type(), cache=result_cache, seed=args.seed)
+
+    players = {"X": args.x, "O": args.o}
+    results = {"X": 0, "O": 0, "draw": 0}
+    latencies = {"X": [], "O": []}
+
+    start = time.perf_counter()
+    for game in range(args.games):
+        if args.game == "classical":
+            result, game_latencies = play_classical(players, backend, rng, args.live)
+        else:
+            result, game_latencies = play_quantum(players, backend, rng, args.time_budget, args.workers)
+        results[result] += 1
+        for symbol in latencies:
+            latencies[symbol].extend(game_latencies[symbol])
+    seconds = time.perf_counter() - start
+
+    return {
+        "config": vars(args),
+        "games": args.games,
+        "seconds": seconds,
+        "games_per_second": args.games / seconds,
+        "results": results,
+        "rates": {outcome: count / args.games for outcome, count in results.items()},
+        "move_latency": {symbol: latency_summary(values) for symbol, values in latencies.items()},
+        "backend_calls": dict(backend.calls),
+        "cache": result_cache.stats(),
+        "quantum_inspire": dict(qi_client.get_client().stats) if args.backend == "remote" else None
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play bot games without the UI and report throughput and results")
+    parser.add_argument("--games", type=int, default=10, help="number of games to play")
+    parser.add_argument("--game", choices=["classical", "quantum"], default="classical",
+                        help="classical tic tac toe with QuantumBot or the quantum game with QuantumSearchBot")
+    parser.add_argument("--x", choices=["bot", "random"], default="bot", help="who plays X, which moves first")
+    parser.add_argument("--o", choices=["bot", "random"], default="random", help="who plays O")
+    parser.add_argument("--backend", choices=["local", "remote"], default="local",
+                        help="simulate in-process or run the circuits on Quantum Inspire")
+    parser.add_argument("--live", action="store_true",
+                        help="let QuantumBot run its circuits instead of using the move table")
+    parser.add_argument("--time-budget", type=float, default=0.2, help="seconds of search per QuantumSearchBot move")
+    parser.add_argument("--workers", type=int, default=1, help="rollout processes per QuantumSearchBot")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the players and the simulation")
+    parser.add_argument("--output", default=None, help="file to write the JSON report to, by default it is printed")
+    args = parser.parse_args(argv)
+
+    report = json.dumps(run(args), indent=4)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, "w") as file:
+            file.write(report)
+
+
+if __name__ == "__main__":
+    main()